@@ -5,42 +5,70 @@ Talk to AI locally in my phone for the first time to help life and learning.
 import toga
 from toga.style import Pack
 from toga.style.pack import COLUMN, ROW
-import threading
 import os
+import time
 from datetime import datetime
-from pathlib import Path
-import json
 
 # 导入我们之前创建的核心模块
 from core.database import DatabaseManager
 from core.ai_client import AIClient
+from core.transcript import Transcript
+from core.ui_updates import UIUpdateCoalescer
+from core.executor import (TaskExecutor, current_task, PRIORITY_CHAT, PRIORITY_USER,
+                           PRIORITY_IMPORT, PRIORITY_BACKGROUND)
 
 
 class Talk_in_App_v01(toga.App):
+    # 冷启动预算：从 startup 开始到窗口显示的时间，超出时打印警告
+    STARTUP_BUDGET_MS = 300
+    # 启动时打印资源路径探测信息（会列出多个目录），只在调试时通过环境变量打开，发布版本保持关闭
+    PATH_DIAGNOSTICS = os.environ.get('IN_APP_PATH_DIAGNOSTICS') == '1'
+    # 语义记忆检索（需要numpy和Ollama中的嵌入模型），默认关闭，通过环境变量开启
+    SEMANTIC_MEMORY = os.environ.get('IN_APP_SEMANTIC_MEMORY') == '1'
+
     def startup(self):
         """Construct and show the Toga application."""
+        started = time.perf_counter()
         self.icon = "ai_companion_icon"
 
-        # 获取应用的专用数据目录
-        data_dir = Path(self.paths.data) / "databases"
-        data_dir.mkdir(parents=True, exist_ok=True)  # 确保目录存在
-
-        # 初始化核心组件
+        # 关键路径只做显示窗口必需的工作；建表、创建目录、检查资源放到窗口显示后的后台阶段
         self.data_dir = self.paths.data
-        self.db = DatabaseManager(self.data_dir)
+        # 数据库延迟打开：第一次访问时才建表，后台阶段会提前触发
+        self.db = DatabaseManager(self.data_dir, lazy=True, semantic_memory=self.SEMANTIC_MEMORY)
         self.ai_client = AIClient()
-
-        # 确保规则文件存在（这会触发DatabaseManager创建默认规则文件）
-        rules_path = os.path.join(self.data_dir, 'rules.json')
-        if not os.path.exists(rules_path):
-            self.db.load_rules()  # 这会创建默认规则文件
+        # 所有后台工作（AI请求、数据库读写、导入导出）都交给统一的执行器，界面线程不做阻塞操作
+        self.executor = TaskExecutor()
 
         # 对话状态
         self.conversation_history = []
 
+        # 导入导出状态管理
+        self.waiting_for_input = None  # 当前等待的输入类型
+        self.selected_db_type = None  # 选择的数据库类型
+        self.import_export_state = None  # 导入导出状态
+
+        # 设置公共目录路径（目录在后台阶段创建）
+        # 使用Download目录下的子目录，避免文件混乱
+        self.public_base_dir = "/storage/emulated/0/Download/ai_companion/"
+        self.import_dir = os.path.join(self.public_base_dir, "import")
+        self.export_dir = os.path.join(self.public_base_dir, "export")
+
+        # 修正：使用 resources 目录而不是 assets
+        # 如果使用 Toga 的标准资源路径
+        self.resources_dir = self.paths.resources if hasattr(self.paths, 'resources') else os.path.join(self.paths.app,
+                                                                                                        'resources')
+        self.predefined_data_dir = os.path.join(self.resources_dir, 'predefined_data')
+
         # 创建主窗口
         self.main_window = toga.MainWindow(title=self.formal_name)
 
+        # 后台线程的界面更新先合并，再以每秒20帧在主线程统一执行和重绘
+        self.ui_updates = UIUpdateCoalescer(self.main_window.app.loop, on_flush=self.render_chat_display,
+                                            interval=0.05)
+
+        # 聊天记录模型：只保留最近的消息，界面显示的文本由它渲染
+        self.transcript = Transcript(max_messages=200)
+
         # 创建界面组件
         self.create_ui()
 
@@ -50,39 +78,71 @@ class Talk_in_App_v01(toga.App):
         # 启动时显示欢迎信息
         self.show_welcome_message()
 
-        # 导入导出状态管理
-        self.waiting_for_input = None  # 当前等待的输入类型
-        self.selected_db_type = None  # 选择的数据库类型
-        self.import_export_state = None  # 导入导出状态
+        startup_ms = (time.perf_counter() - started) * 1000
+        self.startup_stats = {'critical_ms': startup_ms, 'deferred_ms': None}
+        print(f"窗口显示耗时: {startup_ms:.0f} ms（预算 {self.STARTUP_BUDGET_MS} ms）")
+        if startup_ms > self.STARTUP_BUDGET_MS:
+            print(f"⚠️ 启动超出预算 {startup_ms - self.STARTUP_BUDGET_MS:.0f} ms")
 
+        # 窗口显示后再做其余的初始化
+        self.run_in_background(self.process_deferred_startup, priority=PRIORITY_USER, key='deferred_startup',
+                               on_done=self.finish_deferred_startup)
 
-        # 设置公共目录路径
-        # 使用Download目录下的子目录，避免文件混乱
-        self.public_base_dir = "/storage/emulated/0/Download/ai_companion/"
-        self.import_dir = os.path.join(self.public_base_dir, "import")
-        self.export_dir = os.path.join(self.public_base_dir, "export")
+        # 后台预加载模型，第一条消息不必等待模型载入
+        self.start_model_warm_up()
+
+    def process_deferred_startup(self):
+        """启动的后台阶段（在后台线程中运行）：打开数据库、创建导入导出目录、检查资源目录"""
+        started = time.perf_counter()
+
+        # 建表和建立长连接，第一条消息就不用等数据库初始化
+        self.db.open()
+        # 补建对话记忆的全文索引（首次升级时可能要几秒），不放在启动和第一轮对话的路径上
+        self.run_in_background(self.db.sync_memory_index, priority=PRIORITY_BACKGROUND, key='memory_index')
 
-        # 自动创建这些目录（如果不存在）
+        # 自动创建导入导出目录（如果不存在）
+        import_dir, export_dir = self.import_dir, self.export_dir
         try:
-            os.makedirs(self.import_dir, exist_ok=True)
-            os.makedirs(self.export_dir, exist_ok=True)
+            os.makedirs(import_dir, exist_ok=True)
+            os.makedirs(export_dir, exist_ok=True)
             print(f"✅ 公共目录创建成功:")
-            print(f"   导入目录: {self.import_dir}")
-            print(f"   导出目录: {self.export_dir}")
+            print(f"   导入目录: {import_dir}")
+            print(f"   导出目录: {export_dir}")
         except Exception as e:
             print(f"❌ 创建公共目录失败: {e}")
             # 如果失败，回退到应用私有目录
-            self.import_dir = os.path.join(self.data_dir, "import")
-            self.export_dir = os.path.join(self.data_dir, "export")
-            os.makedirs(self.import_dir, exist_ok=True)
-            os.makedirs(self.export_dir, exist_ok=True)
-
-        # 修正：使用 resources 目录而不是 assets
-        # 如果使用 Toga 的标准资源路径
-        self.resources_dir = self.paths.resources if hasattr(self.paths, 'resources') else os.path.join(self.paths.app,
-                                                                                                        'resources')
-        self.predefined_data_dir = os.path.join(self.resources_dir, 'predefined_data')
+            import_dir = os.path.join(self.data_dir, "import")
+            export_dir = os.path.join(self.data_dir, "export")
+            os.makedirs(import_dir, exist_ok=True)
+            os.makedirs(export_dir, exist_ok=True)
+
+        if not os.path.exists(self.predefined_data_dir) and os.path.exists(self.resources_dir):
+            print("❌ 预设数据目录不存在，将创建")
+            os.makedirs(self.predefined_data_dir, exist_ok=True)
+
+        if self.PATH_DIAGNOSTICS:
+            self.print_path_diagnostics()
+
+        return {
+            'import_dir': import_dir,
+            'export_dir': export_dir,
+            'elapsed_ms': (time.perf_counter() - started) * 1000,
+            'migration_error': self.db.migration_error
+        }
 
+    def finish_deferred_startup(self, result):
+        """后台阶段完成后在主线程中更新目录设置"""
+        self.import_dir = result['import_dir']
+        self.export_dir = result['export_dir']
+        self.startup_stats['deferred_ms'] = result['elapsed_ms']
+        print(f"后台启动阶段完成: {result['elapsed_ms']:.0f} ms")
+        if result['migration_error']:
+            # 迁移完成前写入会占用旧数据的ID，所以这次运行期间不保存任何数据
+            self.append_to_chat("系统", f"⚠️ 旧数据迁移失败，本次运行不会保存对话和导入数据，"
+                                      f"请重启应用重试: {result['migration_error']}")
+
+    def print_path_diagnostics(self):
+        """打印资源路径探测信息（调试用，会列出多个目录的内容）"""
         print(f"Resources目录: {self.resources_dir}")
         print(f"预设数据目录: {self.predefined_data_dir}")
 
@@ -93,27 +153,9 @@ class Talk_in_App_v01(toga.App):
                 print("✅ 预设数据目录存在")
                 files = os.listdir(self.predefined_data_dir)
                 print(f"目录中的文件: {files}")
-            else:
-                print("❌ 预设数据目录不存在，将创建")
-                os.makedirs(self.predefined_data_dir, exist_ok=True)
         else:
             print("❌ Resources目录不存在")
 
-        # 同时检查其他可能的路径
-        possible_paths = [
-            self.paths.app,  # 应用主目录
-            os.path.join(self.paths.app, 'resources'),
-            os.path.join(self.paths.app, 'assets'),
-            os.path.join(self.paths.app, 'src', 'resources'),
-        ]
-
-        for path in possible_paths:
-            if os.path.exists(path):
-                print(f"📁 存在的路径: {path}")
-                if os.path.isdir(path):
-                    files = os.listdir(path)
-                    print(f"  包含的文件: {files}")
-
         # 详细的路径调试信息
         print("=== 路径调试信息 ===")
         print(f"应用路径 (self.paths.app): {self.paths.app}")
@@ -305,7 +347,8 @@ class Talk_in_App_v01(toga.App):
 请确保已在Termux中运行: ollama serve
 
 现在开始对话吧！"""
-        self.chat_display.value = welcome_msg + "\n\n"
+        self.transcript.clear(header=welcome_msg + "\n\n")
+        self.refresh_chat_display()
 
     def send_message(self, widget):
         """发送消息处理"""
@@ -328,36 +371,80 @@ class Talk_in_App_v01(toga.App):
             self.handle_import_export_flow(user_input)
             return
 
-        # 显示"思考中..."提示
+        # 显示"思考中..."提示，AI回复开始后这条消息会被替换成回复内容
         thinking_msg = "AI伙伴正在思考..."
-        self.append_to_chat("系统", thinking_msg)
+        message_id = self.append_to_chat("系统", thinking_msg)
 
-        # 在新线程中处理AI回复（避免界面卡顿）
-        thread = threading.Thread(target=self.process_ai_response, args=(user_input,))
-        thread.daemon = True
-        thread.start()
+        # 在后台处理AI回复（避免界面卡顿）
+        task = self.run_in_background(self.process_ai_response, user_input, message_id,
+                                      priority=PRIORITY_CHAT, key='chat')
+        if task is None:
+            self.remove_thinking_message(message_id)
+            self.send_button.enabled = True
 
-    def process_ai_response(self, user_input):
-        """处理AI回复（在后台线程中运行）"""
+    def run_in_background(self, func, *args, priority=PRIORITY_USER, key=None, on_done=None, on_error=None):
+        """把任务交给执行器，on_done(result) / on_error(exception) 会在主线程中调用
+
+        队列已满被拒绝时提示用户并返回 None（后台维护任务被拒绝时不提示）。
+        """
+        task = self.executor.submit(
+            func, *args,
+            priority=priority,
+            key=key,
+            on_done=self.in_main_thread(on_done) if on_done else None,
+            on_error=self.in_main_thread(on_error) if on_error else None
+        )
+        if task is None and priority < PRIORITY_BACKGROUND:
+            self.append_to_chat("系统", "⚠️ 正在处理的任务太多，请稍后再试")
+        return task
+
+    def in_main_thread(self, callback):
+        """包装回调：在后台线程调用时转到主线程执行"""
+        def post(value):
+            self.ui_updates.post(callback, value)
+        return post
+
+    def process_ai_response(self, user_input, message_id):
+        """处理AI回复（在后台线程中运行），message_id 是"思考中..."提示消息的ID"""
         try:
             print("=== 开始AI处理 ===")
             print(f"用户输入: {user_input}")
 
-            # 获取用户偏好（记忆）
-            user_memory = self.db.get_user_preferences()
+            # 获取与本次输入最相关的用户偏好（记忆），偏好表版本用来判断能否接着上一轮的上下文
+            user_memory = self.db.get_relevant_preferences(user_input)
+            memory_version = self.db.get_preferences_version()
             print(f"用户记忆: {user_memory[:100]}...")  # 只打印前100字符
 
-            # 调用AI
+            # 找出相关的过往对话
+            related_memories = self.find_related_memories(user_input)
+            print(f"相关过往对话: {len(related_memories)} 条")
+
+            # 较早对话的滚动摘要
+            conversation_summary = self.db.get_conversation_summary()
+
+            # 流式调用AI，边生成边显示
             print("开始调用AI客户端...")
-            ai_response = self.ai_client.chat(user_input, self.conversation_history, user_memory)
+            chunks = []
+            for chunk in self.ai_client.chat_stream(user_input, self.conversation_history, user_memory,
+                                                    related_memories, conversation_summary, memory_version):
+                if not chunks:
+                    # 收到第一段文本时，用AI回复替换"思考中..."提示
+                    self.ui_updates.post(self.start_ai_stream, message_id)
+                chunks.append(chunk)
+                self.ui_updates.post(self.append_stream_chunk, message_id, chunk)
+
+            ai_response = "".join(chunks)
             print(f"AI回复: {ai_response}")
 
+            # 保存对话到数据库（在后台线程中完成，不阻塞界面）
+            saved = self.db.save_conversation(user_input, ai_response)
 
-            # 在主线程中更新UI
-            self.main_window.app.loop.call_soon_threadsafe(
-                self.update_chat_with_ai_response,
+            # 在主线程中完成收尾（更新历史、启用按钮）
+            self.ui_updates.post(
+                self.finish_ai_response,
                 ai_response,
-                user_input
+                user_input,
+                saved
             )
         except Exception as e:
             error_msg = f"AI回复处理出错: {str(e)}"
@@ -365,28 +452,104 @@ class Talk_in_App_v01(toga.App):
             import traceback
             traceback.print_exc()  # 打印完整堆栈跟踪
 
-            self.main_window.app.loop.call_soon_threadsafe(
+            self.ui_updates.post(
                 self.show_error_and_reenable_button,
-                error_msg
+                error_msg,
+                message_id
             )
 
-    def update_chat_with_ai_response(self, ai_response, user_input):
-        """在主线程中更新AI回复"""
-        # 移除"思考中..."消息，用实际回复替换
-        current_text = self.chat_display.value
-        if "AI伙伴正在思考..." in current_text:
-            lines = current_text.split('\n')
-            # 移除最后两行（思考消息）
-            lines = lines[:-2]
-            self.chat_display.value = '\n'.join(lines) + '\n\n'
-
-        # 显示AI回复
-        self.append_to_chat("AI伙伴", ai_response)
-
-        # 保存对话到数据库
-        success = self.db.save_conversation(user_input, ai_response)
-        if not success:
+    def find_related_memories(self, user_input, k=2):
+        """找出与本次输入相关的过往对话：语义检索优先，全文检索补充，跳过已在最近历史里的"""
+        recent_inputs = {msg.get('user') for msg in self.conversation_history[-2:]}
+
+        candidates = []
+        if self.db.semantic_memory_enabled:
+            # 对话在等待，嵌入请求用较短的超时
+            query_vectors = self.ai_client.embed([user_input], timeout=self.ai_client.query_embed_timeout)
+            if query_vectors:
+                candidates.extend(self.db.search_memory_semantic(
+                    query_vectors[0], self.ai_client.embedding_model, k=k + 2))
+        candidates.extend(self.db.search_memory(user_input, k=k + 2))
+
+        related = []
+        seen_ids = set()
+        for memory in candidates:
+            if memory[0] in seen_ids or memory[1] in recent_inputs:
+                continue
+            seen_ids.add(memory[0])
+            related.append(memory)
+            if len(related) >= k:
+                break
+        return related
+
+    def start_model_warm_up(self):
+        """在后台预加载模型，并在应用打开期间定期续期，避免模型空闲时被Ollama卸载"""
+        self.run_in_background(self.ai_client.warm_up, priority=PRIORITY_BACKGROUND, key='model_warm_up')
+
+        # 在 keep_alive 到期前续期；应用被关闭后模型最多再驻留一个 keep_alive 时长
+        interval = max(60, self.ai_client.keep_alive // 2)
+        self.main_window.app.loop.call_later(interval, self.start_model_warm_up)
+
+    def start_memory_embedding(self):
+        """在后台分批为新对话生成语义向量；再次提交时正在运行的任务会在当前批次后让位"""
+        if not self.db.semantic_memory_enabled:
+            return
+        self.run_in_background(self.process_memory_embedding, priority=PRIORITY_BACKGROUND, key='memory_embedding')
+
+    def process_memory_embedding(self):
+        """生成对话向量（在后台线程中运行）"""
+        task = current_task()
+        self.db.embed_pending_memories(
+            self.ai_client.embed,
+            self.ai_client.embedding_model,
+            should_stop=task.is_cancelled if task else None
+        )
+
+    def start_conversation_summary(self):
+        """在后台把移出提示词的较早对话并入滚动摘要，同一时间只运行一个任务"""
+        self.run_in_background(self.process_conversation_summary, priority=PRIORITY_BACKGROUND,
+                               key='conversation_summary')
+
+    def process_conversation_summary(self, min_turns=4):
+        """更新对话摘要（在后台线程中运行），积累到 min_turns 轮才调用一次模型
+
+        模型一次只处理一个请求，有对话在排队或生成时跳过，积压的轮次留到下次空闲时一起摘要，
+        避免用户的下一条消息排在摘要请求后面。
+        """
+        if self.executor.is_busy(PRIORITY_CHAT):
+            return
+        turns = self.db.get_turns_to_summarize(keep_recent=self.ai_client.recent_turns)
+        if len(turns) < min_turns or self.executor.is_busy(PRIORITY_CHAT):
+            return
+        summary = self.ai_client.summarize(self.db.get_conversation_summary(), turns)
+        if summary:
+            self.db.save_conversation_summary(summary, turns[-1][0])
+            print(f"对话摘要已更新: {summary[:50]}...")
+
+    def remove_thinking_message(self, message_id):
+        """移除"思考中..."消息"""
+        if self.transcript.remove(message_id):
+            self.refresh_chat_display()
+
+    def start_ai_stream(self, message_id):
+        """流式回复开始：把思考提示的位置换成AI回复（主线程）"""
+        current_time = datetime.now().strftime("%H:%M")
+        self.transcript.update(message_id, text="", speaker="AI伙伴", time=current_time)
+        self.refresh_chat_display()
+
+    def append_stream_chunk(self, message_id, chunk):
+        """把流式回复的一段文本追加到AI回复消息（主线程）"""
+        self.transcript.append_text(message_id, chunk)
+        self.refresh_chat_display()
+
+    def finish_ai_response(self, ai_response, user_input, saved=True):
+        """AI回复显示完成后的收尾工作（主线程），对话已在后台线程中保存"""
+        if not saved:
             self.append_to_chat("系统", "⚠️ 对话保存失败")
+        else:
+            # 新对话的语义向量和对话摘要在后台延迟生成，不影响界面
+            self.start_memory_embedding()
+            self.start_conversation_summary()
 
         # 更新对话历史
         self.conversation_history.append({
@@ -401,8 +564,18 @@ class Talk_in_App_v01(toga.App):
         # 重新启用发送按钮
         self.send_button.enabled = True
 
-    def show_error_and_reenable_button(self, error_msg):
-        """显示错误并重新启用发送按钮"""
+    def show_error_and_reenable_button(self, error_msg, message_id=None):
+        """显示错误并重新启用发送按钮
+
+        流式回复中途出错时保留已经显示的部分回复，在末尾标注回复中断；还没有回复内容时移除思考提示。
+        """
+        if message_id is not None:
+            message = self.transcript.get(message_id)
+            if message is not None and message.speaker == "AI伙伴" and message.text:
+                self.transcript.append_text(message_id, "\n⚠️ [回复中断]")
+                self.refresh_chat_display()
+            else:
+                self.remove_thinking_message(message_id)
         self.show_message("错误", error_msg)
         self.send_button.enabled = True
 
@@ -424,7 +597,14 @@ class Talk_in_App_v01(toga.App):
             self.show_message("提示", "时间格式不正确，请使用 HH:MM 格式，如 14:30")
             return
 
-        if self.db.add_schedule(event_time, event_name):
+        self.run_in_background(
+            self.db.add_schedule, event_time, event_name,
+            on_done=lambda success: self.show_add_schedule_result(success, event_time, event_name)
+        )
+
+    def show_add_schedule_result(self, success, event_time, event_name):
+        """显示添加行程的结果（主线程）"""
+        if success:
             self.schedule_time_input.value = ''
             self.schedule_event_input.value = ''
             self.append_to_chat("系统", f"✅ 已添加行程: {event_time} - {event_name}")
@@ -443,32 +623,51 @@ class Talk_in_App_v01(toga.App):
             return False
 
     def check_upcoming_schedules(self, widget):
-        """检查即将到来的行程"""
-        try:
-            schedules = self.db.get_upcoming_schedules()
+        """检查即将到来的行程（生成提醒需要调用模型，在后台进行）"""
+        self.append_to_chat("系统", "正在检查行程...")
+        self.run_in_background(
+            self.process_schedule_check,
+            key='schedule_check',
+            on_done=self.show_schedule_check_result,
+            on_error=lambda e: self.show_message("错误", f"检查行程时出错: {str(e)}")
+        )
 
-            if schedules:
-                schedule_text = "\n".join([f"• {time} - {event}" for time, event in schedules])
+    def process_schedule_check(self):
+        """读取行程并生成智能提醒（后台线程），返回 (提醒, 行程文本)，没有行程时返回 None"""
+        schedules = self.db.get_upcoming_schedules()
+        if not schedules:
+            return None
 
-                # 获取用户记忆来生成智能提醒
-                user_memory = self.db.get_user_preferences()
-                reminder = self.ai_client.generate_reminder(schedule_text, user_memory)
+        schedule_text = "\n".join([f"• {time} - {event}" for time, event in schedules])
 
-                # 将提醒保存到记忆库
-                self.db.save_conversation(f"检查行程: {schedule_text}", reminder)
+        # 获取用户记忆来生成智能提醒
+        user_memory = self.db.get_relevant_preferences(schedule_text)
+        reminder = self.ai_client.generate_reminder(schedule_text, user_memory)
 
-                self.append_to_chat("行程提醒", f"{reminder}\n\n今日安排:\n{schedule_text}")
-            else:
-                self.append_to_chat("系统", "今天没有即将到来的行程")
-        except Exception as e:
-            self.show_message("错误", f"检查行程时出错: {str(e)}")
+        # 将提醒保存到记忆库
+        self.db.save_conversation(f"检查行程: {schedule_text}", reminder, source='schedule')
+        return reminder, schedule_text
+
+    def show_schedule_check_result(self, result):
+        """显示行程提醒（主线程）"""
+        if result:
+            reminder, schedule_text = result
+            self.append_to_chat("行程提醒", f"{reminder}\n\n接下来24小时的安排:\n{schedule_text}")
+        else:
+            self.append_to_chat("系统", "接下来24小时内没有行程")
 
     def view_data(self, widget):
         """查看所有数据 - 直接在聊天页面显示，可滚动查看"""
-        try:
-            # 使用统一的get_all_data方法获取数据
-            all_data = self.db.get_all_data()
+        # 使用统一的get_all_data方法获取数据（在后台读取数据库）
+        self.run_in_background(
+            self.db.get_all_data,
+            on_done=self.show_all_data,
+            on_error=lambda e: self.append_to_chat("系统", f"查看数据时出错: {str(e)}")
+        )
 
+    def show_all_data(self, all_data):
+        """在聊天区域显示所有数据（主线程）"""
+        try:
             if 'error' in all_data:
                 self.append_to_chat("系统", f"获取数据失败: {all_data['error']}")
                 return
@@ -516,16 +715,22 @@ class Talk_in_App_v01(toga.App):
 
     def clear_chat(self, widget):
         """清空聊天显示（不影响数据库）"""
-        self.chat_display.value = "对话记录已清空\n\n"
+        self.transcript.clear(header="对话记录已清空\n\n")
         self.append_to_chat("系统", "对话显示已清空，但所有数据仍保存在数据库中")
 
     def append_to_chat(self, speaker, text):
-        """向聊天区域添加消息"""
-        current_time = datetime.now().strftime("%H:%M")
-        formatted_msg = f"[{current_time}] {speaker}: {text}\n\n"
+        """向聊天区域添加消息，返回消息ID（之后可以修改或删除这条消息）"""
+        message_id = self.transcript.append(speaker, text)
+        self.refresh_chat_display()
+        return message_id
+
+    def refresh_chat_display(self):
+        """请求重绘聊天区域：多次修改合并到下一帧一起渲染"""
+        self.ui_updates.mark_dirty()
 
-        # 添加到显示区域
-        self.chat_display.value += formatted_msg
+    def render_chat_display(self):
+        """用聊天记录模型重新渲染聊天区域（只包含最近的消息），每帧最多一次"""
+        self.chat_display.value = self.transcript.render()
 
         # 尝试滚动到底部 - 使用正确的方法名
         self.chat_display.focus()
@@ -540,10 +745,8 @@ class Talk_in_App_v01(toga.App):
             # 显示处理中状态
             self.append_to_chat("系统", "正在分析对话记录，挖掘新的用户偏好...")
 
-            # 在新线程中执行挖掘，避免界面卡顿
-            thread = threading.Thread(target=self.process_preference_mining)
-            thread.daemon = True
-            thread.start()
+            # 在后台执行挖掘，避免界面卡顿
+            self.run_in_background(self.process_preference_mining, key='preference_mining')
 
         except Exception as e:
             self.show_message("错误", f"开始挖掘时出错: {str(e)}")
@@ -554,14 +757,14 @@ class Talk_in_App_v01(toga.App):
             count, message = self.db.mine_new_preferences()
 
             # 在主线程中更新结果
-            self.main_window.app.loop.call_soon_threadsafe(
+            self.ui_updates.post(
                 self.update_mining_result,
                 count,
                 message
             )
         except Exception as e:
             error_msg = f"偏好挖掘过程出错: {str(e)}"
-            self.main_window.app.loop.call_soon_threadsafe(
+            self.ui_updates.post(
                 self.show_message, "错误", error_msg
             )
 
@@ -615,6 +818,9 @@ class Talk_in_App_v01(toga.App):
         if result.get('success'):
             count = result.get('count', 0)
             self.append_to_chat("系统", f"✅ 成功导入 {count} 条数据到{db_type}数据库")
+            if result.get('skipped'):
+                # 缺少必填字段或行程时间无法识别的数据没有导入
+                self.append_to_chat("系统", f"⚠️ 跳过 {result['skipped']} 条格式不正确的数据")
         else:
             error_msg = result.get('error', '未知错误')
             self.show_message("导入失败", f"导入{db_type}数据库时出错: {error_msg}")
@@ -658,7 +864,7 @@ class Talk_in_App_v01(toga.App):
 
         elif self.waiting_for_input == "import_filename":
             filename = user_input.strip()
-            if not filename.endswith('.json'):
+            if not filename.endswith(('.json', '.jsonl')):
                 filename += '.json'
 
             # 从导入目录读取文件
@@ -671,13 +877,9 @@ class Talk_in_App_v01(toga.App):
                 self.selected_db_type = None
             else:
                 self.append_to_chat("系统", f"开始导入文件: {filename}")
-                # 在新线程中处理导入
-                thread = threading.Thread(
-                    target=self.process_text_import,
-                    args=(self.selected_db_type, file_path)
-                )
-                thread.daemon = True
-                thread.start()
+                # 在后台处理导入
+                self.run_in_background(self.process_text_import, self.selected_db_type, file_path,
+                                       priority=PRIORITY_IMPORT)
                 # 注意：状态会在 process_text_import 完成后重置
 
         # 确保按钮启用
@@ -726,6 +928,7 @@ class Talk_in_App_v01(toga.App):
                 # 生成默认文件名
                 default_filename = f"{db_type}_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
                 self.append_to_chat("系统", f"请输入保存路径（默认: {default_filename}），或输入'取消'退出：")
+                self.append_to_chat("系统", "💡 保存为 .jsonl 文件时，再次导出到同一文件只会追加新增的数据")
                 self.waiting_for_input = "export_file_path"
 
         else:
@@ -742,13 +945,9 @@ class Talk_in_App_v01(toga.App):
                 file_path = user_input
                 self.append_to_chat("系统", f"开始导入文件: {file_path}")
 
-                # 在新线程中处理导入
-                thread = threading.Thread(
-                    target=self.process_text_import,
-                    args=(self.selected_db_type, file_path)
-                )
-                thread.daemon = True
-                thread.start()
+                # 在后台处理导入
+                self.run_in_background(self.process_text_import, self.selected_db_type, file_path,
+                                       priority=PRIORITY_IMPORT)
             else:
                 self.waiting_for_input = None
                 self.append_to_chat("系统", "导入操作已取消")
@@ -764,13 +963,9 @@ class Talk_in_App_v01(toga.App):
 
                 self.append_to_chat("系统", f"开始导出到: {save_path}")
 
-                # 在新线程中处理导出
-                thread = threading.Thread(
-                    target=self.process_text_export,
-                    args=(self.selected_db_type, save_path)
-                )
-                thread.daemon = True
-                thread.start()
+                # 在后台处理导出
+                self.run_in_background(self.process_text_export, self.selected_db_type, save_path,
+                                       priority=PRIORITY_IMPORT)
             else:
                 self.waiting_for_input = None
                 self.append_to_chat("系统", "导出操作已取消")
@@ -782,27 +977,15 @@ class Talk_in_App_v01(toga.App):
     def process_text_import(self, db_type, file_path):
         """处理文本交互的导入（后台线程）"""
         try:
-            # 先检查文件格式
-            is_valid, message = self.check_import_file(file_path)
-            if not is_valid:
-                self.main_window.app.loop.call_soon_threadsafe(
-                    self.append_to_chat, "系统", f"❌❌ {message}"
-                )
-                return
-
-            # 读取JSON文件
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-
-            # 调用DatabaseManager的导入方法
-            result = self.db.import_from_json(db_type, data)
+            # 边解析边导入，文件格式在同一遍中校验，格式错误时整个导入回滚
+            result = self.db.import_from_file(db_type, file_path, self.make_import_progress_callback())
 
             # 重置状态
             self.waiting_for_input = None
             self.selected_db_type = None
 
             # 在主线程中显示结果
-            self.main_window.app.loop.call_soon_threadsafe(
+            self.ui_updates.post(
                 self.show_import_result,
                 result,
                 db_type
@@ -811,13 +994,28 @@ class Talk_in_App_v01(toga.App):
         except Exception as e:
             error_msg = f"导入失败: {str(e)}"
             print(f"导入错误: {error_msg}")
-            self.main_window.app.loop.call_soon_threadsafe(
+            self.ui_updates.post(
                 self.append_to_chat, "系统", f"❌ {error_msg}"
             )
             # 重置状态
             self.waiting_for_input = None
             self.selected_db_type = None
 
+    def make_import_progress_callback(self, report_every=5000):
+        """创建导入进度回调（在后台线程调用），每处理 report_every 条在界面上报告一次"""
+        last_reported = [0]
+
+        def on_progress(processed):
+            if processed - last_reported[0] >= report_every:
+                last_reported[0] = processed
+                # 同一帧内只显示最新的进度
+                self.ui_updates.post(
+                    self.append_to_chat, "系统", f"导入中... 已处理 {processed} 条",
+                    key='import_progress'
+                )
+
+        return on_progress
+
     def process_text_export(self, db_type, save_path):
         """处理文本交互的导出（后台线程）"""
         try:
@@ -827,14 +1025,14 @@ class Talk_in_App_v01(toga.App):
                 os.makedirs(save_dir, exist_ok=True)
 
             # 调用DatabaseManager的导出方法
-            result = self.db.export_to_json(db_type, save_path)
+            result = self.db.export_to_file(db_type, save_path)
 
             # 重置状态
             self.waiting_for_input = None
             self.selected_db_type = None
 
             # 在主线程中显示结果
-            self.main_window.app.loop.call_soon_threadsafe(
+            self.ui_updates.post(
                 self.show_export_result,
                 result,
                 db_type,
@@ -844,7 +1042,7 @@ class Talk_in_App_v01(toga.App):
         except Exception as e:
             error_msg = f"导出失败: {str(e)}"
             print(f"导出错误: {error_msg}")
-            self.main_window.app.loop.call_soon_threadsafe(
+            self.ui_updates.post(
                 self.append_to_chat, "系统", f"❌ {error_msg}"
             )
             # 重置状态
@@ -863,7 +1061,7 @@ class Talk_in_App_v01(toga.App):
         """列出可用的文件"""
         try:
             import_files = os.listdir(self.import_dir)
-            json_files = [f for f in import_files if f.endswith('.json')]
+            json_files = [f for f in import_files if f.endswith(('.json', '.jsonl'))]
 
             self.append_to_chat("系统", "=== 可导入的文件 ===")
             if json_files:
@@ -873,7 +1071,7 @@ class Talk_in_App_v01(toga.App):
                 self.append_to_chat("系统", "导入目录中没有JSON文件")
 
             export_files = os.listdir(self.export_dir)
-            export_json_files = [f for f in export_files if f.endswith('.json')]
+            export_json_files = [f for f in export_files if f.endswith(('.json', '.jsonl'))]
 
             self.append_to_chat("系统", "=== 已导出的文件 ===")
             if export_json_files:
@@ -897,15 +1095,14 @@ class Talk_in_App_v01(toga.App):
             if not os.path.exists(file_path):
                 return False, f"文件不存在: {file_path}"
 
-            # 读取并导入数据
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-
-            # 调用DatabaseManager的导入方法
-            result = self.db.import_from_json(db_type, data)
+            # 边解析边导入数据
+            result = self.db.import_from_file(db_type, file_path, self.make_import_progress_callback())
 
             if result.get('success'):
-                return True, f"成功导入 {result.get('count', 0)} 条数据"
+                message = f"成功导入 {result.get('count', 0)} 条数据"
+                if result.get('skipped'):
+                    message += f"，跳过 {result['skipped']} 条格式不正确的数据"
+                return True, message
             else:
                 return False, result.get('error', '导入失败')
 
@@ -929,7 +1126,7 @@ class Talk_in_App_v01(toga.App):
                 if os.path.exists(dir_path):
                     print(f"🔍 检查目录: {dir_path}")
                     files = os.listdir(dir_path)
-                    json_files = [f for f in files if f.endswith('.json')]
+                    json_files = [f for f in files if f.endswith(('.json', '.jsonl'))]
                     if json_files:
                         print(f"✅ 在 {dir_path} 找到JSON文件: {json_files}")
                         break
@@ -962,12 +1159,8 @@ class Talk_in_App_v01(toga.App):
             if not os.path.exists(file_path):
                 return {'success': False, 'error': f"文件不存在: {file_path}"}
 
-            # 读取并导入数据
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-
-            # 调用DatabaseManager的导入方法
-            result = self.db.import_from_json(db_type, data)
+            # 边解析边导入数据
+            result = self.db.import_from_file(db_type, file_path, self.make_import_progress_callback())
             return result
 
         except Exception as e:
@@ -979,7 +1172,7 @@ class Talk_in_App_v01(toga.App):
             result = self.import_from_assets(filename, db_type)
 
             # 在主线程中显示结果
-            self.main_window.app.loop.call_soon_threadsafe(
+            self.ui_updates.post(
                 self.show_import_result,
                 result,
                 db_type
@@ -987,7 +1180,7 @@ class Talk_in_App_v01(toga.App):
 
         except Exception as e:
             error_msg = f"assets导入失败: {str(e)}"
-            self.main_window.app.loop.call_soon_threadsafe(
+            self.ui_updates.post(
                 self.append_to_chat, "系统", f"❌❌ {error_msg}"
             )
         finally:
@@ -998,7 +1191,7 @@ class Talk_in_App_v01(toga.App):
     def handle_filename_input(self, user_input):
         """处理文件名输入"""
         filename = user_input.strip()
-        if not filename.endswith('.json'):
+        if not filename.endswith(('.json', '.jsonl')):
             filename += '.json'
 
         # 从 import 目录读取文件
@@ -1012,31 +1205,14 @@ class Talk_in_App_v01(toga.App):
 
         self.append_to_chat("系统", f"开始导入文件: {filename}")
 
-        # 在新线程中处理导入
-        thread = threading.Thread(
-            target=self.process_text_import,
-            args=(self.selected_db_type, file_path)
-        )
-        thread.daemon = True
-        thread.start()
-
-    def check_import_file(self, file_path):
-        """检查导入文件是否有效"""
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-
-            if not isinstance(data, list):
-                return False, "文件格式错误：应该是JSON数组"
-
-            return True, "文件格式正确"
-        except Exception as e:
-            return False, f"文件读取失败: {str(e)}"
+        # 在后台处理导入
+        self.run_in_background(self.process_text_import, self.selected_db_type, file_path,
+                               priority=PRIORITY_IMPORT)
 
     def handle_asset_filename_input(self, user_input):
         """处理assets文件名输入"""
         filename = user_input.strip()
-        if not filename.endswith('.json'):
+        if not filename.endswith(('.json', '.jsonl')):
             filename += '.json'
 
         # 从assets目录读取文件
@@ -1051,24 +1227,16 @@ class Talk_in_App_v01(toga.App):
 
         self.append_to_chat("系统", f"开始从assets导入文件: {filename}")
 
-        # 在新线程中处理导入
-        thread = threading.Thread(
-            target=self.process_asset_import,
-            args=(filename, self.selected_db_type)
-        )
-        thread.daemon = True
-        thread.start()
+        # 在后台处理导入
+        self.run_in_background(self.process_asset_import, filename, self.selected_db_type,
+                               priority=PRIORITY_IMPORT)
 
     def handle_import_confirmation(self, user_input):
         """处理导入确认"""
         if user_input.lower() in ['是', 'yes', 'y']:
-            # 在新线程中处理导入
-            thread = threading.Thread(
-                target=self.process_text_import,
-                args=(self.selected_db_type, self.temp_file_path)
-            )
-            thread.daemon = True
-            thread.start()
+            # 在后台处理导入
+            self.run_in_background(self.process_text_import, self.selected_db_type, self.temp_file_path,
+                                   priority=PRIORITY_IMPORT)
         else:
             self.append_to_chat("系统", "导入操作已取消")
             self.waiting_for_input = None
@@ -1077,10 +1245,16 @@ class Talk_in_App_v01(toga.App):
 
     def delete_schedule(self, widget):
         """删除行程 - 文本交互方式"""
-        try:
-            # 获取所有行程供用户选择
-            schedules = self.db.get_all_data().get('schedules', [])
+        # 在后台获取所有行程供用户选择
+        self.run_in_background(
+            lambda: self.db.get_all_data().get('schedules', []),
+            on_done=self.show_deletable_schedules,
+            on_error=lambda e: self.append_to_chat("系统", f"获取行程列表时出错: {str(e)}")
+        )
 
+    def show_deletable_schedules(self, schedules):
+        """列出可删除的行程并等待用户输入ID（主线程）"""
+        try:
             if not schedules:
                 self.append_to_chat("系统", "当前没有可删除的行程")
                 return
@@ -1106,32 +1280,35 @@ class Talk_in_App_v01(toga.App):
         try:
             schedule_id = int(user_input.strip())
 
-            # 执行删除
-            success, message = self.db.delete_schedule(schedule_id)
-
-            if success:
-                self.append_to_chat("系统", f"✅ {message}")
-            else:
-                self.append_to_chat("系统", f"❌ {message}")
+            # 在后台执行删除
+            self.run_in_background(
+                self.db.delete_schedule, schedule_id,
+                on_done=self.show_delete_schedule_result,
+                on_error=lambda e: self.append_to_chat("系统", f"删除行程时出错: {str(e)}")
+            )
 
         except ValueError:
             self.append_to_chat("系统", "❌ 请输入有效的数字ID")
-        except Exception as e:
-            self.append_to_chat("系统", f"删除行程时出错: {str(e)}")
 
         # 清理状态
         self.waiting_for_input = None
 
+    def show_delete_schedule_result(self, result):
+        """显示删除行程的结果（主线程）"""
+        success, message = result
+        if success:
+            self.append_to_chat("系统", f"✅ {message}")
+        else:
+            self.append_to_chat("系统", f"❌ {message}")
+
     def confirm_delete_schedule(self, user_input):
         """确认删除行程"""
         if user_input.lower() in ['确认', 'yes', 'y', '是']:
-            # 执行删除
-            success, message = self.db.delete_schedule(self.temp_schedule_id)
-
-            if success:
-                self.append_to_chat("系统", f"✅ {message}")
-            else:
-                self.append_to_chat("系统", f"❌ {message}")
+            # 在后台执行删除
+            self.run_in_background(
+                self.db.delete_schedule, self.temp_schedule_id,
+                on_done=self.show_delete_schedule_result
+            )
 
         else:
             self.append_to_chat("系统", "删除操作已取消")
@@ -1,66 +1,214 @@
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import threading
+import time
+from collections import deque
+
+
+class EndpointSelector:
+    """记住上次可用的端点，并为每个端点维护熔断状态
+
+    - 成功过的端点在 ttl 秒内优先使用，不再从头逐个尝试
+    - 某个端点连续失败 failure_threshold 次后熔断 cooldown 秒，期间直接跳过
+    - 熔断时间过后允许再试一次（半开状态），成功即恢复
+    """
+
+    def __init__(self, names, ttl=600, failure_threshold=2, cooldown=60):
+        self.names = list(names)
+        self.ttl = ttl
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.preferred = None
+        self.preferred_time = 0
+        self.failures = {name: 0 for name in self.names}
+        self.open_until = {name: 0 for name in self.names}
+        self._lock = threading.Lock()
+
+    def is_available(self, name):
+        """端点是否处于可尝试状态（未熔断或熔断已到期）"""
+        with self._lock:
+            return time.monotonic() >= self.open_until[name]
+
+    def candidates(self, allowed=None):
+        """返回本次应尝试的端点顺序：缓存的可用端点优先，熔断中的端点被跳过"""
+        now = time.monotonic()
+        with self._lock:
+            names = [name for name in self.names if allowed is None or name in allowed]
+            if self.preferred in names and now - self.preferred_time < self.ttl:
+                names.remove(self.preferred)
+                names.insert(0, self.preferred)
+            return [name for name in names if now >= self.open_until[name]]
+
+    def record_success(self, name):
+        with self._lock:
+            self.preferred = name
+            self.preferred_time = time.monotonic()
+            self.failures[name] = 0
+            self.open_until[name] = 0
+
+    def record_failure(self, name):
+        with self._lock:
+            if self.preferred == name:
+                # 缓存的端点失败了，下次重新探测
+                self.preferred = None
+            self.failures[name] += 1
+            if self.failures[name] >= self.failure_threshold:
+                self.open_until[name] = time.monotonic() + self.cooldown
+                print(f"端点 {name} 连续失败 {self.failures[name]} 次，暂停使用 {self.cooldown} 秒")
+
+
+class GenerateSession:
+    """保存 /api/generate 上一轮返回的 context（模型已处理过的token序列）
+
+    下一轮带上 context 并只发送新的内容，Ollama 会复用已缓存的KV，不必把偏好和历史重新处理一遍。
+    偏好变化、对话历史对不上（例如上一轮出错）或 context 过长时需要重新开始，发送完整提示词。
+
+    偏好是否变化按 memory_key 判断：调用方提供偏好表的版本时用版本号，
+    这样每轮按输入重新挑选的偏好文本不同也能接着用，本次会话沿用第一轮放进提示词的偏好；
+    没有提供版本时按偏好文本比较。
+    """
+
+    def __init__(self, max_tokens=1536):
+        # 超过这个长度就重新开始，避免超出模型的上下文窗口
+        self.max_tokens = max_tokens
+        self.reset()
+
+    def reset(self):
+        self.context = None
+        self.memory_key = None
+        self.last_input = None
+        self.memory_ids = set()
+
+    def can_continue(self, conversation_history, memory_key):
+        """上一轮的 context 是否可以接着用"""
+        return (
+            self.context is not None
+            and len(self.context) < self.max_tokens
+            and memory_key == self.memory_key
+            and bool(conversation_history)
+            and conversation_history[-1].get('user') == self.last_input
+        )
+
+    def update(self, context, user_input, memory_key, related_memories, continued):
+        if not continued:
+            self.memory_ids = set()
+        self.memory_ids.update(memory[0] for memory in related_memories or [])
+        self.context = context
+        self.last_input = user_input
+        self.memory_key = memory_key
 
 
 class AIClient:
-    def __init__(self, model="qwen2.5:0.5b"):
+    def __init__(self, model="qwen2.5:0.5b", keep_alive=1800):
         self.model = model
+        # 每次请求都告诉Ollama模型空闲多少秒后再卸载（Ollama默认5分钟），
+        # 应用打开期间再由 warm_up 定期续期
+        self.keep_alive = keep_alive
         # 尝试不同的端点
         self.base_urls = [
             "http://127.0.0.1:11434/api/generate",
             "http://127.0.0.1:11434/v1/chat/completions",
             "http://127.0.0.1:11434/api/chat"
         ]
-        self.timeout = 300  # 减少到5分钟，避免手机卡死
+        self.endpoint_urls = {
+            'generate': self.base_urls[0],
+            'openai': self.base_urls[1],
+            'chat': self.base_urls[2],
+        }
+        # 端点探测一次后缓存结果，失败的端点熔断一段时间
+        self.endpoints = EndpointSelector(['generate', 'openai', 'chat'])
+        # 语义记忆使用的嵌入模型和接口（/api/embed 支持批量，旧版Ollama只有 /api/embeddings）
+        self.embedding_model = "nomic-embed-text"
+        self.embedding_urls = {
+            'embed': "http://127.0.0.1:11434/api/embed",
+            'embeddings': "http://127.0.0.1:11434/api/embeddings",
+        }
+        self.embedding_endpoints = EndpointSelector(['embed', 'embeddings'])
+        # 对话时为用户输入生成向量的读取超时：超时就只用全文检索，不拖慢回复
+        self.query_embed_timeout = 3
+        # 提示词中原样保留的最近对话轮数，更早的对话只通过摘要体现
+        self.recent_turns = 2
+        self.summary_max_chars = 200
+        # 接着上一轮的 context 生成，复用模型已处理过的提示词前缀
+        self.reuse_context = True
+        self.generate_session = GenerateSession()
+        # 最近几轮的提示词处理耗时（来自Ollama返回的 prompt_eval_duration），用于比较复用前后的效果
+        self.prompt_eval_log = deque(maxlen=50)
+        self.connect_timeout = 5  # 本机服务，连接不上就是没启动，不必久等
+        self.timeout = 300  # 读取超时，减少到5分钟，避免手机卡死
 
-    def chat(self, user_input, conversation_history, user_memory):
-        """与AI对话 - 优化版本，考虑用户偏好和记忆"""
-        print(f"开始处理用户输入: {user_input}")
+        # 复用同一个会话，保持与Ollama的长连接，避免每次请求都重新建立TCP连接
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0)
+        self.session.mount('http://', adapter)
 
-        # 构建智能提示词，考虑用户偏好和对话历史
-        prompt = self.build_chat_prompt(user_input, conversation_history, user_memory)
+    def build_payload(self, endpoint, prompt, stream, context=None):
+        """按端点要求的格式构建请求数据，context 只有 /api/generate 支持"""
+        system_message = {"role": "system", "content": "你是一个贴心的AI学习伙伴，根据用户的偏好和记忆进行个性化对话。"}
 
-        # 方法1: 简单生成请求（最适合小模型）
-        payload_simple = {
-            "model": self.model,
-            "prompt": prompt,
-            "stream": False
-        }
+        if endpoint == 'generate':
+            # 简单生成请求（最适合小模型）
+            payload = {
+                "model": self.model,
+                "prompt": prompt,
+                "stream": stream,
+                "keep_alive": self.keep_alive
+            }
+            if context:
+                payload["context"] = context
+            return payload
+        elif endpoint == 'openai':
+            # OpenAI兼容格式
+            return {
+                "model": self.model,
+                "messages": [system_message, {"role": "user", "content": prompt}],
+                "stream": stream,
+                "max_tokens": 150  # 限制输出长度，避免手机卡顿
+            }
+        else:
+            # Ollama聊天格式
+            return {
+                "model": self.model,
+                "messages": [system_message, {"role": "user", "content": prompt}],
+                "stream": stream,
+                "keep_alive": self.keep_alive
+            }
 
-        # 方法2: OpenAI兼容格式
-        payload_openai = {
-            "model": self.model,
-            "messages": [
-                {"role": "system", "content": "你是一个贴心的AI学习伙伴，根据用户的偏好和记忆进行个性化对话。"},
-                {"role": "user", "content": prompt}
-            ],
-            "stream": False,
-            "max_tokens": 150  # 限制输出长度，避免手机卡顿
-        }
+    def chat(self, user_input, conversation_history, user_memory, related_memories=None,
+             conversation_summary=None, memory_version=None):
+        """与AI对话 - 优化版本，考虑用户偏好和记忆
 
-        # 尝试不同的端点和格式
-        endpoints_to_try = [
-            (self.base_urls[0], payload_simple),  # 原始端点 + 简单格式
-            (self.base_urls[1], payload_openai),  # OpenAI端点 + OpenAI格式
-            (self.base_urls[2], payload_simple),  # 聊天端点 + 简单格式
-        ]
+        memory_version 是偏好表的版本（例如 DatabaseManager.get_preferences_version()），
+        用来判断能否接着上一轮的 context，见 GenerateSession。
+        """
+        print(f"开始处理用户输入: {user_input}")
 
-        for url, payload in endpoints_to_try:
+        # 优先使用上次成功的端点，熔断中的端点直接跳过
+        for endpoint in self.endpoints.candidates():
+            url = self.endpoint_urls[endpoint]
+            # 构建智能提示词，考虑用户偏好和对话历史（能接着上一轮时只发送新内容）
+            prompt, context = self.prepare_prompt(endpoint, user_input, conversation_history, user_memory,
+                                                  related_memories, conversation_summary, memory_version)
+            payload = self.build_payload(endpoint, prompt, stream=False, context=context)
             try:
                 print(f"尝试端点: {url}")
                 # 简化日志输出，减少手机负担
                 print(f"请求数据长度: {len(str(payload))}")
 
-                response = requests.post(
+                response = self.session.post(
                     url,
                     json=payload,
-                    timeout=self.timeout
+                    timeout=(self.connect_timeout, self.timeout)
                 )
 
                 print(f"响应状态码: {response.status_code}")
 
                 if response.status_code == 200:
                     data = response.json()
+                    self.endpoints.record_success(endpoint)
+                    self.record_generation(endpoint, data, user_input, user_memory, related_memories,
+                                           continued=context is not None, memory_version=memory_version)
 
                     # 不同端点返回格式不同
                     if 'response' in data:
@@ -74,32 +222,286 @@ class AIClient:
                         return str(data)[:100]
                 else:
                     print(f"错误响应: {response.text[:100]}")  # 简化错误日志
+                    self.endpoints.record_failure(endpoint)
 
             except requests.exceptions.ConnectionError:
                 print(f"无法连接到: {url}")
-                continue
+                self.endpoints.record_failure(endpoint)
             except requests.exceptions.Timeout:
                 print(f"端点超时: {url}")
-                continue
+                self.endpoints.record_failure(endpoint)
             except Exception as e:
                 print(f"端点 {url} 错误: {str(e)}")
-                continue
+                self.endpoints.record_failure(endpoint)
 
         return "抱歉，我现在有点忙，请稍后再试。"
 
-    def build_chat_prompt(self, user_input, conversation_history, user_memory):
-        """构建简洁的对话prompt - 完全按照你提供的示例风格"""
+    def chat_stream(self, user_input, conversation_history, user_memory, related_memories=None,
+                    conversation_summary=None, memory_version=None):
+        """与AI对话 - 流式版本，逐段产出模型生成的文本
+
+        使用 /api/generate 或 /api/chat 的流式接口（Ollama逐行返回JSON），
+        优先使用上次成功的端点；在收到第一段文本前失败才会换下一个端点，
+        都不可用时产出一条提示信息。
+        """
+        print(f"开始流式处理用户输入: {user_input}")
+
+        # OpenAI兼容端点的流式格式不同，这里只使用Ollama原生端点
+        for endpoint in self.endpoints.candidates(allowed=('generate', 'chat')):
+            url = self.endpoint_urls[endpoint]
+            prompt, context = self.prepare_prompt(endpoint, user_input, conversation_history, user_memory,
+                                                  related_memories, conversation_summary, memory_version)
+            payload = self.build_payload(endpoint, prompt, stream=True, context=context)
+            received_any = False
+            final = {}
+            try:
+                print(f"尝试流式端点: {url}")
+                with self.session.post(url, json=payload, stream=True,
+                                       timeout=(self.connect_timeout, self.timeout)) as response:
+                    print(f"响应状态码: {response.status_code}")
+                    if response.status_code != 200:
+                        print(f"错误响应: {response.text[:100]}")
+                        self.endpoints.record_failure(endpoint)
+                        continue
+
+                    for chunk in self.iter_stream_chunks(response, final):
+                        if not received_any:
+                            received_any = True
+                            self.endpoints.record_success(endpoint)
+                        yield chunk
+
+                if not received_any:
+                    self.endpoints.record_failure(endpoint)
+                else:
+                    self.record_generation(endpoint, final, user_input, user_memory, related_memories,
+                                           continued=context is not None, memory_version=memory_version)
+
+            except requests.exceptions.ConnectionError:
+                print(f"无法连接到: {url}")
+                self.endpoints.record_failure(endpoint)
+            except requests.exceptions.Timeout:
+                print(f"端点超时: {url}")
+                self.endpoints.record_failure(endpoint)
+            except Exception as e:
+                print(f"端点 {url} 错误: {str(e)}")
+                self.endpoints.record_failure(endpoint)
+
+            if received_any:
+                # 已经输出了内容（或中途出错时已输出部分内容），不再换端点重新生成
+                if not final:
+                    # 回复不完整，上一轮的 context 对不上了
+                    self.generate_session.reset()
+                return
+
+        yield "抱歉，我现在有点忙，请稍后再试。"
+
+    def warm_up(self):
+        """预加载模型：不带prompt的生成请求只会把模型载入内存并按 keep_alive 续期，不做推理
+
+        模型已经在内存中时几乎立即返回，所以也可以定期调用，防止空闲时被卸载。
+        """
+        start = time.perf_counter()
+        try:
+            response = self.session.post(
+                self.endpoint_urls['generate'],
+                json={"model": self.model, "keep_alive": self.keep_alive},
+                timeout=(self.connect_timeout, self.timeout)
+            )
+            if response.status_code == 200:
+                print(f"模型预加载完成: {self.model}, 用时 {time.perf_counter() - start:.1f} 秒")
+                return True
+            print(f"模型预加载失败，状态码: {response.status_code}")
+        except Exception as e:
+            print(f"模型预加载失败: {e}")
+        return False
+
+    def embed(self, texts, timeout=None):
+        """调用Ollama的嵌入接口，返回与 texts 一一对应的向量列表，都不可用时返回 None
+
+        timeout 为整个调用（包括换端点重试）最多等待的秒数；不指定时每个请求使用 self.timeout
+        （后台批量生成向量时可以慢慢等）。
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        def read_timeout():
+            if deadline is None:
+                return self.timeout
+            return max(0.1, deadline - time.monotonic())
+
+        for endpoint in self.embedding_endpoints.candidates():
+            if deadline is not None and time.monotonic() >= deadline:
+                print("嵌入请求超过等待时间，放弃本次检索")
+                break
+            url = self.embedding_urls[endpoint]
+            try:
+                if endpoint == 'embed':
+                    response = self.session.post(
+                        url,
+                        json={"model": self.embedding_model, "input": texts, "keep_alive": self.keep_alive},
+                        timeout=(self.connect_timeout, read_timeout())
+                    )
+                    vectors = response.json().get('embeddings') if response.status_code == 200 else None
+                else:
+                    # 旧接口一次只能嵌入一段文本
+                    vectors = []
+                    for text in texts:
+                        response = self.session.post(
+                            url,
+                            json={"model": self.embedding_model, "prompt": text, "keep_alive": self.keep_alive},
+                            timeout=(self.connect_timeout, read_timeout())
+                        )
+                        if response.status_code != 200:
+                            vectors = None
+                            break
+                        vectors.append(response.json().get('embedding'))
+
+                if vectors and len(vectors) == len(texts) and all(vectors):
+                    self.embedding_endpoints.record_success(endpoint)
+                    return vectors
+
+                print(f"嵌入接口 {url} 返回异常，状态码: {response.status_code}")
+                self.embedding_endpoints.record_failure(endpoint)
+
+            except requests.exceptions.ConnectionError:
+                print(f"无法连接到: {url}")
+                self.embedding_endpoints.record_failure(endpoint)
+            except requests.exceptions.Timeout:
+                print(f"端点超时: {url}")
+                self.embedding_endpoints.record_failure(endpoint)
+            except Exception as e:
+                print(f"端点 {url} 错误: {str(e)}")
+                self.embedding_endpoints.record_failure(endpoint)
+
+        return None
+
+    def iter_stream_chunks(self, response, final=None):
+        """解析Ollama的流式响应（每行一个JSON），产出其中的文本片段
+
+        final 为字典时，最后一行（done=true，包含 context 和耗时统计）会被写入其中。
+        """
+        for line in response.iter_lines():
+            if not line:
+                continue
+            data = json.loads(line)
+            if 'error' in data:
+                raise RuntimeError(data['error'])
+
+            # /api/generate 返回 response 字段，/api/chat 返回 message.content
+            if 'response' in data:
+                chunk = data['response']
+            else:
+                chunk = data.get('message', {}).get('content', '')
+
+            if chunk:
+                yield chunk
+            if data.get('done'):
+                if final is not None:
+                    final.update(data)
+                break
+
+    @staticmethod
+    def memory_key(user_memory, memory_version):
+        """判断偏好是否变化的依据：有偏好表版本时用版本，否则用偏好文本"""
+        return user_memory if memory_version is None else memory_version
+
+    def prepare_prompt(self, endpoint, user_input, conversation_history, user_memory, related_memories,
+                       conversation_summary, memory_version=None):
+        """返回 (prompt, context)：/api/generate 能接着上一轮的 context 时只发送新的内容"""
+        memory_key = self.memory_key(user_memory, memory_version)
+        if (endpoint == 'generate' and self.reuse_context
+                and self.generate_session.can_continue(conversation_history, memory_key)):
+            new_memories = [
+                memory for memory in related_memories or []
+                if memory[0] not in self.generate_session.memory_ids
+            ]
+            return self.build_followup_prompt(user_input, new_memories), self.generate_session.context
+
+        prompt = self.build_chat_prompt(user_input, conversation_history, user_memory, related_memories,
+                                        conversation_summary)
+        return prompt, None
+
+    def record_generation(self, endpoint, data, user_input, user_memory, related_memories, continued,
+                          memory_version=None):
+        """记录一轮生成的提示词处理耗时，并保存 context 供下一轮复用"""
+        prompt_eval_count = data.get('prompt_eval_count')
+        prompt_eval_duration = data.get('prompt_eval_duration')
+        if prompt_eval_count is not None or prompt_eval_duration is not None:
+            entry = {
+                'endpoint': endpoint,
+                'reused': continued,
+                'prompt_eval_count': prompt_eval_count or 0,
+                'prompt_eval_ms': (prompt_eval_duration or 0) / 1e6,  # Ollama返回的是纳秒
+            }
+            self.prompt_eval_log.append(entry)
+            print(f"提示词处理: {entry['prompt_eval_count']} tokens, {entry['prompt_eval_ms']:.0f} ms"
+                  f"{'（复用上一轮上下文）' if continued else ''}")
+
+        if endpoint == 'generate' and self.reuse_context and data.get('context'):
+            self.generate_session.update(data['context'], user_input, self.memory_key(user_memory, memory_version),
+                                         related_memories, continued)
+        else:
+            self.generate_session.reset()
+
+    def get_prompt_eval_stats(self):
+        """按是否复用上下文分别统计最近几轮的平均提示词处理耗时"""
+        stats = {}
+        for reused in (False, True):
+            entries = [entry for entry in self.prompt_eval_log if entry['reused'] == reused]
+            if entries:
+                stats['reused' if reused else 'full'] = {
+                    'turns': len(entries),
+                    'avg_tokens': sum(entry['prompt_eval_count'] for entry in entries) / len(entries),
+                    'avg_ms': sum(entry['prompt_eval_ms'] for entry in entries) / len(entries),
+                }
+        return stats
+
+    def build_followup_prompt(self, user_input, related_memories=None):
+        """接着上一轮 context 时的提示词：偏好和历史已经在上下文中，只发送新的内容"""
+        prompt_parts = []
+
+        if related_memories:
+            prompt_parts.append("相关的过往对话：")
+            for _, past_user, past_ai, _ in related_memories:
+                prompt_parts.append(f"用户: {self.shorten(past_user)}")
+                prompt_parts.append(f"AI: {self.shorten(past_ai)}")
+
+        prompt_parts.append(f"用户: {user_input}")
+        prompt_parts.append("AI: ")
+
+        return "\n".join(prompt_parts)
+
+    def build_chat_prompt(self, user_input, conversation_history, user_memory, related_memories=None,
+                          conversation_summary=None):
+        """构建简洁的对话prompt - 完全按照你提供的示例风格
+
+        related_memories: 从全文索引检索到的过往对话 [(ID, user_input, AI_output, timestamp), ...]
+        conversation_summary: 较早对话的滚动摘要，长度固定，不随对话增多而变长
+        """
         prompt_parts = []
 
         # 1. 用户偏好信息（如果有）
         if user_memory and user_memory != "目前还没有记录任何用户偏好信息。":
             prompt_parts.append(user_memory)
 
+        # 1.4 较早对话的摘要
+        if conversation_summary:
+            prompt_parts.append(f"之前对话的摘要：{conversation_summary}")
+
+        # 1.5 与当前输入相关的过往对话（截断，避免prompt过长）
+        if related_memories:
+            prompt_parts.append("相关的过往对话：")
+            for _, past_user, past_ai, _ in related_memories:
+                prompt_parts.append(f"用户: {self.shorten(past_user)}")
+                prompt_parts.append(f"AI: {self.shorten(past_ai)}")
+
         # 2. 对话历史（保持简洁）
         if conversation_history:
             prompt_parts.append("当前对话历史：")
-            # 只保留最近2轮对话，避免prompt过长
-            recent_history = conversation_history[-2:] if len(conversation_history) > 2 else conversation_history
+            # 只保留最近几轮对话，避免prompt过长（更早的对话由摘要代替）
+            recent_history = conversation_history[-self.recent_turns:]
             for msg in recent_history:
                 prompt_parts.append(f"用户: {msg.get('user', '')}")
                 prompt_parts.append(f"AI: {msg.get('ai', '')}")
@@ -113,6 +515,12 @@ class AIClient:
 
         return "\n".join(prompt_parts)
 
+    @staticmethod
+    def shorten(text, limit=50):
+        """截断过长的文本"""
+        text = text or ''
+        return text if len(text) <= limit else text[:limit] + "..."
+
     def generate_reminder(self, schedule_info, user_memory):
         """为行程生成智能提醒 - 优化版本，考虑用户偏好"""
         # 构建个性化的提醒提示词
@@ -122,24 +530,87 @@ class AIClient:
             "model": self.model,
             "prompt": prompt,
             "stream": False,
-            "max_tokens": 100  # 提醒信息限制长度
+            "max_tokens": 100,  # 提醒信息限制长度
+            "keep_alive": self.keep_alive
         }
 
+        # 生成端点处于熔断状态时直接使用备用提醒，不再等待超时
+        if not self.endpoints.is_available('generate'):
+            return self.get_fallback_reminder(schedule_info)
+
         try:
-            response = requests.post(
-                self.base_urls[0],  # 使用第一个端点，最稳定
+            response = self.session.post(
+                self.endpoint_urls['generate'],  # 使用生成端点，最稳定
                 json=payload,
-                timeout=120  # 提醒功能超时缩短
+                timeout=(self.connect_timeout, 120)  # 提醒功能超时缩短
             )
             if response.status_code == 200:
+                self.endpoints.record_success('generate')
                 data = response.json()
                 return data.get('response', '该完成计划的任务了！加油！')
             else:
+                self.endpoints.record_failure('generate')
                 return self.get_fallback_reminder(schedule_info)
         except Exception as e:
             print(f"生成提醒失败: {e}")
+            self.endpoints.record_failure('generate')
             return self.get_fallback_reminder(schedule_info)
 
+    def summarize(self, previous_summary, turns):
+        """把已有摘要和新的几轮对话合并成新的摘要，失败时返回 None
+
+        turns: [(ID, user_input, AI_output), ...]
+        """
+        prompt = self.build_summary_prompt(previous_summary, turns)
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": False,
+            "keep_alive": self.keep_alive
+        }
+
+        # 摘要不着急，生成端点熔断时下次再做
+        if not self.endpoints.is_available('generate'):
+            return None
+
+        try:
+            response = self.session.post(
+                self.endpoint_urls['generate'],
+                json=payload,
+                timeout=(self.connect_timeout, 120)
+            )
+            if response.status_code == 200:
+                self.endpoints.record_success('generate')
+                summary = response.json().get('response', '').strip()
+                # 模型不一定遵守字数要求，超出的部分截掉，保证提示词长度固定
+                return summary[:self.summary_max_chars] or None
+            else:
+                self.endpoints.record_failure('generate')
+                return None
+        except Exception as e:
+            print(f"生成对话摘要失败: {e}")
+            self.endpoints.record_failure('generate')
+            return None
+
+    def build_summary_prompt(self, previous_summary, turns):
+        """构建对话摘要的prompt"""
+        prompt_parts = []
+
+        if previous_summary:
+            prompt_parts.append(f"之前的对话摘要：{previous_summary}")
+
+        prompt_parts.append("新的对话：")
+        for _, past_user, past_ai in turns:
+            prompt_parts.append(f"用户: {self.shorten(past_user, 100)}")
+            prompt_parts.append(f"AI: {self.shorten(past_ai, 100)}")
+
+        prompt_parts.append(
+            f"请把以上内容合并成一段不超过{self.summary_max_chars}字的摘要，"
+            "只保留用户的情况、需求和约定好的事情："
+        )
+
+        return "\n".join(prompt_parts)
+
     def build_reminder_prompt(self, schedule_info, user_memory):
         """构建简洁的行程提醒prompt"""
         prompt_parts = []
@@ -164,4 +635,8 @@ class AIClient:
         elif "运动" in schedule_info or "健身" in schedule_info:
             return "运动时间到！身体健康最重要，动起来吧！🏃‍♂️"
         else:
-            return "该完成计划的任务了！一步一个脚印，加油！✨"
\ No newline at end of file
+            return "该完成计划的任务了！一步一个脚印，加油！✨"
+
+    def close(self):
+        """关闭HTTP会话（应用退出时调用）"""
+        self.session.close()
@@ -1,11 +1,113 @@
 import sqlite3
 import os
 import json
-from datetime import datetime, time
+import hashlib
+import threading
+from contextlib import contextmanager
+import re
+from datetime import datetime, time, timedelta, timezone
+from time import sleep
+
+from .matcher import KeywordMatcher
+from .retrieval import PreferenceRetriever, build_match_query, segment_text
+from .json_stream import dump_array, dump_lines, iter_array, iter_cursor_dicts, iter_lines
+from . import semantic
+
+
+class ConnectionManager:
+    """为每个数据库文件保持一个长连接，避免每次调用都重新打开文件"""
+
+    def __init__(self, timeout=10, on_connect=None, on_first_use=None):
+        self.timeout = timeout
+        # 新建连接后的初始化回调 on_connect(db_path, conn)，例如注册自定义SQL函数
+        self.on_connect = on_connect
+        # 第一次使用任何连接前调用一次的回调 on_first_use()，例如建表（延迟到真正需要数据库时）
+        self.on_first_use = on_first_use
+        self._ready = on_first_use is None
+        self._ready_lock = threading.RLock()
+        self._initializing = False
+        self._connections = {}
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def ensure_ready(self):
+        """执行 on_first_use（只执行一次）；其他线程等待它完成，回调内部再取连接时直接放行"""
+        if self._ready:
+            return
+        with self._ready_lock:
+            if self._ready or self._initializing:
+                return
+            self._initializing = True
+            try:
+                self.on_first_use()
+            finally:
+                self._initializing = False
+                self._ready = True
+
+    def _get_lock(self, db_path):
+        with self._guard:
+            lock = self._locks.get(db_path)
+            if lock is None:
+                lock = threading.RLock()
+                self._locks[db_path] = lock
+            return lock
+
+    @contextmanager
+    def connection(self, db_path):
+        """获取数据库连接 - 同一文件的访问通过锁串行化，正常退出时提交，出错时回滚"""
+        self.ensure_ready()
+        lock = self._get_lock(db_path)
+        with lock:
+            conn = self._connections.get(db_path)
+            if conn is None:
+                # 连接会在后台线程（AI回复、挖掘、导入）之间共享，由上面的锁保证安全
+                conn = sqlite3.connect(db_path, timeout=self.timeout, check_same_thread=False)
+                if self.on_connect:
+                    self.on_connect(db_path, conn)
+                self._connections[db_path] = conn
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    @contextmanager
+    def dedicated(self, db_path, read_only=False):
+        """单独打开一个连接，用完即关闭，不占用共享长连接的锁（用于导出、导入、加载索引等耗时操作）
+
+        WAL模式下，这个连接上的读取在自己的快照上进行，与共享连接上的读写互不阻塞；
+        写入仍要与其他写入者排队（SQLite同一时间只有一个写事务），由 timeout 控制等待时间。
+        read_only=True 时禁止写入。
+        """
+        self.ensure_ready()
+        conn = sqlite3.connect(db_path, timeout=self.timeout, check_same_thread=False)
+        try:
+            if self.on_connect:
+                self.on_connect(db_path, conn)
+            if read_only:
+                conn.execute("PRAGMA query_only = ON")
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def close_all(self):
+        """关闭所有长连接"""
+        with self._guard:
+            paths = list(self._connections)
+        for db_path in paths:
+            with self._get_lock(db_path):
+                conn = self._connections.pop(db_path, None)
+                if conn is not None:
+                    conn.close()
 
 
 class DatabaseManager:
-    def __init__(self, data_dir):
+    def __init__(self, data_dir, lazy=False, semantic_memory=False):
         # 确保数据目录存在
         if not os.path.exists(data_dir):
             try:
@@ -15,18 +117,62 @@ class DatabaseManager:
                 print(f"创建数据目录失败: {e}")
 
         self.data_dir = data_dir
-        self.memory_db_path = os.path.join(data_dir, 'memory.db')
-        self.preferences_db_path = os.path.join(data_dir, 'preferences.db')
-        self.schedule_db_path = os.path.join(data_dir, 'schedule.db')
+        # 所有表都在同一个数据库文件中，跨表查询（例如偏好关联到来源对话）不需要ATTACH
+        self.db_path = os.path.join(data_dir, 'ai_companion.db')
+        # 旧版本按类型分开的三个数据库文件，首次启动新版本时迁移到 db_path（原文件保留作为备份）
+        self.legacy_db_paths = {
+            'memory': os.path.join(data_dir, 'memory.db'),
+            'preferences': os.path.join(data_dir, 'preferences.db'),
+            'schedule': os.path.join(data_dir, 'schedule.db'),
+        }
+
+        # 迁移失败时的错误信息，此时数据库只读
+        self.migration_error = None
+
+        # 长连接管理，所有数据库操作都通过它进行；
+        # lazy=True 时不在构造时建表，第一次访问数据库（或调用 open）时再初始化，不拖慢应用启动
+        self.connections = ConnectionManager(
+            on_connect=self._setup_connection,
+            on_first_use=self.init_databases if lazy else None
+        )
+
+        # 对话记忆全文索引（需要SQLite支持FTS5）
+        self.memory_search_enabled = False
+
+        # 对话记忆的语义向量索引（需要numpy），首次检索时从数据库加载。
+        # 默认关闭：开启后每轮对话前都要先请求嵌入模型，手机上还可能与对话模型同时驻留内存
+        self.semantic_memory_enabled = semantic_memory and semantic.is_available()
+        self._semantic_index = None
+        self._semantic_model = None
+        self._semantic_lock = threading.Lock()
+        # 近似最近邻（IVF）索引文件，与记忆库放在同一目录
+        self.semantic_index_path = os.path.join(data_dir, 'memory_ann.npz')
+
+        # 渲染好的用户偏好文本缓存：偏好表被本进程修改时递增版本号，
+        # 被其他程序修改时由 PRAGMA data_version 发现
+        self._preferences_generation = 0
+        self._preferences_cache = None
+        self._retriever = None
+
+        # 放进提示词的偏好最多占用的字数，偏好很多时只保留与当前输入最相关的
+        self.preference_char_budget = 400
 
         # 初始化数据库
-        self.init_databases()
+        if not lazy:
+            self.init_databases()
 
         # 加载规则
-        self.rules = self.load_rules()
+        self.load_rules()
 
     def load_rules(self):
-        """加载偏好挖掘规则"""
+        """加载偏好挖掘规则，并编译关键词匹配器"""
+        rules = self._read_rules_file()
+        self.rules = rules
+        self.matcher = KeywordMatcher(rules)
+        return rules
+
+    def _read_rules_file(self):
+        """读取规则文件，不存在时创建默认规则"""
         default_rules = {
             "fact": ["我叫", "我是", "我的名字是", "你可以叫我", "我学", "专业是"],
             "like": ["喜欢", "爱", "讨厌", "不喜欢", "受不了", "挺喜欢"],
@@ -48,89 +194,544 @@ class DatabaseManager:
             print(f"加载规则文件失败，使用默认规则: {e}")  # 调试信息
             return default_rules
 
+    # 每个连接建立时设置的PRAGMA：WAL模式下读写互不阻塞，synchronous=NORMAL 在WAL下
+    # 只在检查点时同步磁盘（断电最多丢失最近的事务，不会损坏数据库），
+    # cache_size 为负数时单位是KB，mmap_size 让读取直接映射文件、减少拷贝
+    CONNECTION_PRAGMAS = [
+        "PRAGMA journal_mode = WAL",
+        "PRAGMA synchronous = NORMAL",
+        "PRAGMA cache_size = -8000",
+        "PRAGMA mmap_size = 67108864",
+    ]
+
+    # 后台批量写入（导入、补建索引）每提交一批后暂停的秒数：等待中的写入按退避间隔重试，
+    # 不暂停的话下一批会立即重新拿到写锁，对话保存可能一直等下去
+    BATCH_PAUSE = 0.05
+
     def init_databases(self):
-        """初始化所有数据库表 - 增强错误处理"""
-        databases = [
-            (self.memory_db_path, '''
-                CREATE TABLE IF NOT EXISTS MEMORY
-                (ID INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_input TEXT NOT NULL,
-                AI_output TEXT NOT NULL,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)
-            '''),
-            (self.preferences_db_path, '''
-                CREATE TABLE IF NOT EXISTS PREFERENCES
-                (ID INTEGER PRIMARY KEY AUTOINCREMENT,
-                category TEXT NOT NULL,
-                key_text TEXT NOT NULL,
-                value_text TEXT,
-                source_ID INTEGER,
-                CONSTRAINT uc_content UNIQUE (key_text, value_text))
-            '''),
-            (self.schedule_db_path, '''
-                CREATE TABLE IF NOT EXISTS SCHEDULE
-                (ID INTEGER PRIMARY KEY AUTOINCREMENT,
-                event_time TEXT NOT NULL,
-                event_name TEXT NOT NULL,
-                created_time DATETIME DEFAULT CURRENT_TIMESTAMP)
-            ''')
+        """初始化数据库：按版本号执行还没执行过的迁移，再建立对话记忆索引
+
+        迁移失败时数据库切换为只读（见 migration_error），直到下次启动迁移成功。
+        否则旧数据还没复制过来时新写入的行会占用旧数据的ID，之后重新迁移时旧数据会因ID冲突被忽略。
+        """
+        try:
+            with self.connections.connection(self.db_path) as conn:
+                self._run_migrations(conn)
+            print(f"初始化数据库成功: {self.db_path}")  # 调试信息
+        except Exception as e:
+            print(f"初始化数据库失败 {self.db_path}: {e}")  # 调试信息
+            self.migration_error = str(e)
+            try:
+                with self.connections.connection(self.db_path) as conn:
+                    conn.execute("PRAGMA query_only = ON")
+            except Exception as e:
+                print(f"切换为只读失败: {e}")  # 调试信息
+            return
+
+        try:
+            with self.connections.connection(self.db_path) as conn:
+                self._ensure_memory_index(conn)
+        except Exception as e:
+            print(f"初始化对话记忆索引失败: {e}")  # 调试信息
+
+    def open(self):
+        """确保数据库已经初始化（lazy 模式下可以在后台线程中提前调用）"""
+        self.connections.ensure_ready()
+
+    def schema_migrations(self):
+        """数据库结构的版本迁移 [(版本号, 迁移函数), ...]，只能在末尾追加新版本"""
+        return [
+            (1, self._migrate_create_tables),
+            (2, self._migrate_legacy_databases),
+            (3, self._migrate_add_indexes),
+            (4, self._migrate_add_memory_source),
         ]
 
-        for db_path, create_sql in databases:
+    def _run_migrations(self, conn):
+        """执行版本号（PRAGMA user_version）之后的迁移，每个迁移在一个事务中完成"""
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for target, migrate in self.schema_migrations():
+            if target <= version:
+                continue
+            conn.execute("BEGIN")
+            migrate(conn)
+            conn.execute(f"PRAGMA user_version = {target}")
+            conn.commit()
+            version = target
+            print(f"数据库迁移到版本 {target}: {migrate.__name__}")  # 调试信息
+        return version
+
+    def get_schema_version(self):
+        """返回数据库当前的结构版本"""
+        with self.connections.connection(self.db_path) as conn:
+            return conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def _migrate_create_tables(self, conn):
+        """版本1：创建所有表"""
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS MEMORY
+            (ID INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_input TEXT NOT NULL,
+            AI_output TEXT NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS MEMORY_EMBEDDING
+            (memory_ID INTEGER PRIMARY KEY,
+            model TEXT NOT NULL,
+            vector BLOB NOT NULL)
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS PREFERENCES
+            (ID INTEGER PRIMARY KEY AUTOINCREMENT,
+            category TEXT NOT NULL,
+            key_text TEXT NOT NULL,
+            value_text TEXT,
+            source_ID INTEGER,
+            FOREIGN KEY (source_ID) REFERENCES MEMORY (ID)
+            CONSTRAINT uc_content UNIQUE (key_text, value_text))
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS META
+            (key TEXT PRIMARY KEY,
+            value TEXT)
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS SCHEDULE
+            (ID INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_time TEXT NOT NULL,
+            event_name TEXT NOT NULL,
+            created_time DATETIME DEFAULT CURRENT_TIMESTAMP)
+        ''')
+
+    # 旧数据库文件中需要迁移的表和列（保留原ID，偏好的来源、向量索引、导入导出游标都依赖ID）
+    LEGACY_TABLES = {
+        'memory': [
+            ('MEMORY', ['ID', 'user_input', 'AI_output', 'timestamp']),
+            ('MEMORY_EMBEDDING', ['memory_ID', 'model', 'vector']),
+        ],
+        'preferences': [
+            ('PREFERENCES', ['ID', 'category', 'key_text', 'value_text', 'source_ID']),
+            ('META', ['key', 'value']),
+        ],
+        'schedule': [
+            ('SCHEDULE', ['ID', 'event_time', 'event_name', 'created_time']),
+        ],
+    }
+
+    def _migrate_legacy_databases(self, conn, batch_size=1000):
+        """版本2：把旧版本的三个数据库文件中的数据复制到合并后的数据库
+
+        在调用方的事务中完成，出错时整体回滚，下次启动重新迁移。旧文件只读取不修改。
+        """
+        for db_type, tables in self.LEGACY_TABLES.items():
+            legacy_path = self.legacy_db_paths[db_type]
+            if not os.path.exists(legacy_path):
+                continue
+
+            legacy = sqlite3.connect(legacy_path)
             try:
-                conn = sqlite3.connect(db_path)
-                c = conn.cursor()
-                c.execute(create_sql)
-                conn.commit()
-                conn.close()
-                print(f"初始化数据库表成功: {db_path}")  # 调试信息
+                for table, columns in tables:
+                    exists = legacy.execute(
+                        "SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table,)
+                    ).fetchone()
+                    if not exists:
+                        continue
+
+                    column_list = ', '.join(columns)
+                    cursor = legacy.execute(f"SELECT {column_list} FROM {table}")
+                    insert_sql = (f"INSERT OR IGNORE INTO {table} ({column_list}) "
+                                  f"VALUES ({', '.join('?' * len(columns))})")
+                    count = 0
+                    while True:
+                        rows = cursor.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        conn.executemany(insert_sql, rows)
+                        count += len(rows)
+                    print(f"迁移旧数据 {os.path.basename(legacy_path)}/{table}: {count} 条")  # 调试信息
+            finally:
+                legacy.close()
+
+    def _migrate_add_indexes(self, conn):
+        """版本3：为按时间、类别的查询建立索引，并给旧版本只有时分的行程补上日期
+
+        旧版本的行程时间只保存了 HH:MM，按创建时间（本地时间）推算出它指的是哪一天：
+        不早于创建时刻的是当天，否则是第二天，与 normalize_event_time 的规则一致。
+        """
+        conn.execute('''
+            UPDATE SCHEDULE
+            SET event_time = date(created_time, 'localtime',
+                    CASE WHEN substr('0' || event_time, -5) < strftime('%H:%M', created_time, 'localtime')
+                         THEN '+1 day' ELSE '+0 day' END) || ' ' || substr('0' || event_time, -5)
+            WHERE created_time IS NOT NULL
+              AND (event_time GLOB '[0-9]:[0-5][0-9]' OR event_time GLOB '[0-2][0-9]:[0-5][0-9]')
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_schedule_event_time ON SCHEDULE (event_time)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_memory_timestamp ON MEMORY (timestamp)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_preferences_category ON PREFERENCES (category)")
+
+    def _migrate_add_memory_source(self, conn):
+        """版本4：记录每条对话的来源，对话摘要只取真正的聊天
+
+        source 为 'schedule'（行程提醒）或 'import'（导入的数据）；普通对话为 'chat'，
+        旧版本和其他程序写入的对话为 NULL，也当作普通对话。已有的导入数据无法分辨，保持 NULL。
+        """
+        conn.execute("ALTER TABLE MEMORY ADD COLUMN source TEXT")
+        conn.execute("UPDATE MEMORY SET source = 'schedule' WHERE user_input LIKE '检查行程:%'")
+
+    def _setup_connection(self, db_path, conn):
+        """新建连接时的初始化：设置PRAGMA，注册分词函数并建立对话记忆索引触发器"""
+        for pragma in self.CONNECTION_PRAGMAS:
+            conn.execute(pragma).fetchall()
+        if self.migration_error:
+            # 迁移没有完成，导入等单独的连接也不能写入
+            conn.execute("PRAGMA query_only = ON")
+        conn.create_function('segment_text', 1, segment_text, deterministic=True)
+        exists = conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name='MEMORY'"
+        ).fetchone()
+        if exists and not self.migration_error:
+            self._ensure_memory_index(conn)
+
+    def _ensure_memory_index(self, conn):
+        """创建MEMORY的全文索引表，以及保持索引同步的触发器
+
+        索引中存放的是分好词的文本（中文切成单字和两字词），这样内置的unicode61分词器
+        也能检索中文。分词函数只注册在本程序的连接上，所以触发器建成临时触发器：
+        其他程序（例如电脑端脚本）写入记忆库时不会因为缺少函数而失败，
+        它们写入的记录由 sync_memory_index 补建索引。
+        """
+        try:
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS MEMORY_FTS "
+                "USING fts5(user_tokens, ai_tokens, content='', tokenize='unicode61')"
+            )
+        except sqlite3.OperationalError as e:
+            print(f"当前SQLite不支持FTS5，长期记忆检索不可用: {e}")
+            self.memory_search_enabled = False
+            return
+
+        conn.execute('''
+            CREATE TEMP TRIGGER IF NOT EXISTS memory_fts_insert AFTER INSERT ON main.MEMORY
+            BEGIN
+                INSERT INTO MEMORY_FTS (rowid, user_tokens, ai_tokens)
+                VALUES (new.ID, segment_text(new.user_input), segment_text(new.AI_output));
+            END
+        ''')
+        conn.execute('''
+            CREATE TEMP TRIGGER IF NOT EXISTS memory_fts_delete AFTER DELETE ON main.MEMORY
+            BEGIN
+                INSERT INTO MEMORY_FTS (MEMORY_FTS, rowid, user_tokens, ai_tokens)
+                VALUES ('delete', old.ID, segment_text(old.user_input), segment_text(old.AI_output));
+            END
+        ''')
+        conn.execute('''
+            CREATE TEMP TRIGGER IF NOT EXISTS memory_fts_update AFTER UPDATE ON main.MEMORY
+            BEGIN
+                INSERT INTO MEMORY_FTS (MEMORY_FTS, rowid, user_tokens, ai_tokens)
+                VALUES ('delete', old.ID, segment_text(old.user_input), segment_text(old.AI_output));
+                INSERT INTO MEMORY_FTS (rowid, user_tokens, ai_tokens)
+                VALUES (new.ID, segment_text(new.user_input), segment_text(new.AI_output));
+            END
+        ''')
+        self.memory_search_enabled = True
+
+    def sync_memory_index(self, batch_size=2000):
+        """为还没有索引的对话补建全文索引（首次启用或其他程序写入后），返回补建条数
+
+        记录很多时分词要几秒，所以在后台任务中调用：在单独的连接上按ID分批补建、每批提交，
+        不占用共享连接的锁，也不长时间持有写锁。补建完成前 search_memory 只检索已有索引的对话。
+        """
+        if not self.memory_search_enabled:
+            return 0
+        added = 0
+        try:
+            with self.connections.dedicated(self.db_path) as conn:
+                max_id = conn.execute("SELECT MAX(ID) FROM MEMORY").fetchone()[0] or 0
+                last_id = 0
+                while last_id < max_id:
+                    cursor = conn.execute('''
+                        INSERT INTO MEMORY_FTS (rowid, user_tokens, ai_tokens)
+                        SELECT ID, segment_text(user_input), segment_text(AI_output) FROM MEMORY
+                        WHERE ID > ? AND ID <= ?
+                          AND NOT EXISTS (SELECT 1 FROM MEMORY_FTS WHERE rowid = MEMORY.ID)
+                    ''', (last_id, last_id + batch_size))
+                    # 索引表内部的写入也会计入total_changes，这里用rowcount统计
+                    added += cursor.rowcount
+                    conn.commit()
+                    sleep(self.BATCH_PAUSE)
+                    last_id += batch_size
+            if added:
+                print(f"补建对话记忆索引: {added} 条")  # 调试信息
+            return added
+        except Exception as e:
+            print(f"同步对话记忆索引时出错: {e}")  # 调试信息
+            return added
+
+    def search_memory(self, query, k=3):
+        """全文检索与 query 最相关的 k 条历史对话
+
+        返回 [(ID, user_input, AI_output, timestamp), ...]，按相关度从高到低排列。
+        sync_memory_index 在后台补建完成之前，只能检索到已经有索引的对话。
+        """
+        if not self.memory_search_enabled:
+            return []
+
+        match_query = build_match_query(query)
+        if not match_query:
+            return []
+
+        try:
+            with self.connections.connection(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT m.ID, m.user_input, m.AI_output, m.timestamp
+                    FROM MEMORY_FTS f JOIN MEMORY m ON m.ID = f.rowid
+                    WHERE MEMORY_FTS MATCH ?
+                    ORDER BY f.rank
+                    LIMIT ?
+                ''', (match_query, k))
+                return cursor.fetchall()
+        except Exception as e:
+            print(f"检索对话记忆时出错: {e}")  # 调试信息
+            return []
+
+    def embed_pending_memories(self, embed, model, batch_size=32, max_chars=500, should_stop=None):
+        """分批为还没有向量（或向量来自其他模型）的对话生成嵌入，返回新增条数
+
+        embed(texts) 返回与 texts 一一对应的向量列表，失败时返回 None（例如 AIClient.embed）。
+        向量归一化后按float16存入 MEMORY_EMBEDDING，并同步追加到内存中的索引。
+        should_stop() 返回 True 时在当前批次结束后停止（例如任务被新的任务取代）。
+        """
+        if not self.semantic_memory_enabled:
+            return 0
+
+        total = 0
+        last_id = 0
+        while not (should_stop and should_stop()):
+            try:
+                with self.connections.connection(self.db_path) as conn:
+                    cursor = conn.cursor()
+                    cursor.execute('''
+                        SELECT m.ID, m.user_input, m.AI_output FROM MEMORY m
+                        LEFT JOIN MEMORY_EMBEDDING e ON e.memory_ID = m.ID
+                        WHERE m.ID > ? AND (e.memory_ID IS NULL OR e.model != ?)
+                        ORDER BY m.ID
+                        LIMIT ?
+                    ''', (last_id, model, batch_size))
+                    rows = cursor.fetchall()
             except Exception as e:
-                print(f"初始化数据库表失败 {db_path}: {e}")  # 调试信息
+                print(f"读取待嵌入的对话时出错: {e}")  # 调试信息
+                break
+            if not rows:
+                break
+
+            # 嵌入请求可能较慢，不在持有数据库连接时进行
+            texts = [f"用户: {user_input}\nAI: {ai_output}"[:max_chars] for _, user_input, ai_output in rows]
+            vectors = embed(texts)
+            if not vectors or len(vectors) != len(rows):
+                print("嵌入服务不可用，稍后再试")  # 调试信息
+                break
+
+            ids = [row[0] for row in rows]
+            blobs = [semantic.vector_to_blob(vector) for vector in vectors]
+            # 写入数据库和追加到内存索引在同一把锁内完成，避免与加载索引交错导致重复
+            with self._semantic_lock:
+                try:
+                    with self.connections.connection(self.db_path) as conn:
+                        conn.executemany(
+                            "INSERT OR REPLACE INTO MEMORY_EMBEDDING (memory_ID, model, vector) VALUES (?, ?, ?)",
+                            [(memory_id, model, blob) for memory_id, blob in zip(ids, blobs)]
+                        )
+                except Exception as e:
+                    print(f"保存对话向量时出错: {e}")  # 调试信息
+                    break
+
+                if self._semantic_index is not None and self._semantic_model == model:
+                    self._semantic_index.add(ids, [semantic.blob_to_vector(blob) for blob in blobs])
+
+            total += len(rows)
+            last_id = ids[-1]
+
+        if total:
+            print(f"新增对话向量: {total} 条")  # 调试信息
+        self.update_semantic_ann(model)
+        return total
+
+    def update_semantic_ann(self, model, save_every=256):
+        """需要时（重新）训练近似最近邻索引，并把索引保存到文件
+
+        新向量在加入时已经归入最近的簇，这里只在累计一定数量后才写文件，
+        没保存的部分下次加载时会重新归簇。
+        """
+        if not self.semantic_memory_enabled:
+            return False
+        try:
+            with self._semantic_lock:
+                index = self._get_semantic_index(model)
+            # 训练较慢，不持有锁，训练期间检索仍使用旧的状态
+            if index.needs_training():
+                index.train()
+            elif index.unsaved_count < save_every:
+                return False
+            return index.save(self.semantic_index_path, model)
+        except Exception as e:
+            print(f"更新语义索引时出错: {e}")  # 调试信息
+            return False
+
+    def _get_semantic_index(self, model):
+        """返回指定模型的内存索引，没有加载时从数据库加载（调用方需持有 _semantic_lock）"""
+        if self._semantic_index is None or self._semantic_model != model:
+            self._semantic_index = self._load_semantic_index(model)
+            self._semantic_model = model
+        return self._semantic_index
+
+    def _load_semantic_index(self, model):
+        """从数据库加载指定模型的全部对话向量，构建内存索引"""
+        index = semantic.SemanticIndex()
+        # 向量可能很多，在只读连接上读取，不阻塞对话时的其他查询
+        with self.connections.dedicated(self.db_path, read_only=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT memory_ID, vector FROM MEMORY_EMBEDDING WHERE model = ? ORDER BY memory_ID",
+                (model,)
+            )
+            while True:
+                rows = cursor.fetchmany(1000)
+                if not rows:
+                    break
+                index.add([row[0] for row in rows], [semantic.blob_to_vector(row[1]) for row in rows])
+
+        if index.load(self.semantic_index_path, model):
+            print(f"加载对话向量: {len(index)} 条（使用近似索引）")  # 调试信息
+        else:
+            print(f"加载对话向量: {len(index)} 条")  # 调试信息
+        return index
+
+    def search_memory_semantic(self, query_vector, model, k=3, min_score=0.35):
+        """按语义相似度检索最相关的 k 条历史对话
+
+        返回 [(ID, user_input, AI_output, timestamp), ...]，按相似度从高到低排列，
+        相似度低于 min_score 的结果会被丢弃。
+        """
+        if not self.semantic_memory_enabled or query_vector is None:
+            return []
+
+        try:
+            with self._semantic_lock:
+                index = self._get_semantic_index(model)
+
+            hits = [(memory_id, score) for memory_id, score in index.search(query_vector, k) if score >= min_score]
+            if not hits:
+                return []
+
+            with self.connections.connection(self.db_path) as conn:
+                cursor = conn.cursor()
+                placeholders = ','.join('?' * len(hits))
+                cursor.execute(
+                    f"SELECT ID, user_input, AI_output, timestamp FROM MEMORY WHERE ID IN ({placeholders})",
+                    [memory_id for memory_id, _ in hits]
+                )
+                rows = {row[0]: row for row in cursor.fetchall()}
+            return [rows[memory_id] for memory_id, _ in hits if memory_id in rows]
+        except Exception as e:
+            print(f"语义检索对话记忆时出错: {e}")  # 调试信息
+            return []
+
+    def get_meta(self, key, default=None):
+        """读取META表中保存的状态值"""
+        try:
+            with self.connections.connection(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT value FROM META WHERE key = ?", (key,))
+                row = cursor.fetchone()
+            return row[0] if row else default
+        except Exception as e:
+            print(f"读取状态 {key} 时出错: {e}")
+            return default
+
+    def set_meta(self, key, value):
+        """向META表写入状态值"""
+        try:
+            with self.connections.connection(self.db_path) as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO META (key, value) VALUES (?, ?)",
+                    (key, str(value))
+                )
+            return True
+        except Exception as e:
+            print(f"保存状态 {key} 时出错: {e}")
+            return False
+
+    def get_rules_version(self):
+        """计算当前规则的版本哈希（关键词顺序也会影响匹配结果，所以不排序）"""
+        rules_text = json.dumps(self.rules, ensure_ascii=False)
+        return hashlib.sha1(rules_text.encode('utf-8')).hexdigest()
 
     def mine_new_preferences(self):
-        """挖掘新的用户偏好"""
+        """挖掘新的用户偏好 - 只分析上次挖掘之后新增的对话"""
         try:
-            # 只需要打开memory数据库，获取所有对话记录
-            conn_memory = sqlite3.connect(self.memory_db_path)
-            cursor_memory = conn_memory.cursor()
-            cursor_memory.execute("SELECT ID, user_input FROM MEMORY")
-            all_conversations = cursor_memory.fetchall()
-            conn_memory.close()
+            # 读取挖掘游标：上次处理到的MEMORY.ID和当时的规则版本
+            rules_version = self.get_rules_version()
+            last_mined_id = int(self.get_meta('mining_last_id', 0))
+            if self.get_meta('mining_rules_version') != rules_version:
+                # 规则变化后需要从头重新挖掘
+                last_mined_id = 0
+
+            with self.connections.connection(self.db_path) as conn_memory:
+                cursor_memory = conn_memory.cursor()
+                cursor_memory.execute(
+                    "SELECT ID, user_input FROM MEMORY WHERE ID > ? ORDER BY ID",
+                    (last_mined_id,)
+                )
+                all_conversations = cursor_memory.fetchall()
 
             if not all_conversations:
+                if last_mined_id > 0:
+                    return 0, "没有新的对话记录可供分析"
                 return 0, "没有发现对话记录可供分析"
 
-            new_preferences_count = 0
+            # 先收集所有候选偏好，最后在一个事务中批量写入
+            candidates = []
+
+            # 规则被直接替换过时重新编译匹配器
+            if self.matcher.rules is not self.rules:
+                self.matcher = KeywordMatcher(self.rules)
 
             for conv_id, user_input in all_conversations:
-                for category, keywords in self.rules.items():
-                    for keyword in keywords:
-                        if keyword in user_input:
-                            try:
-                                keyword_index = user_input.index(keyword)
-                                content_after_keyword = user_input[keyword_index + len(keyword):].strip()
-
-                                # 提取关键词后的内容（取第一个短语）
-                                if content_after_keyword:
-                                    # 简单的分割，取第一个有意义的片段
-                                    extracted_content = content_after_keyword.split('。')[0].split('，')[0].split(' ')[0]
-                                    extracted_content = extracted_content[:20]  # 限制长度
-
-                                    if extracted_content and len(extracted_content) > 0:
-                                        if category == 'fact' and ('名字' in keyword or '叫我' in keyword):
-                                            key_to_store = 'user_name'
-                                            value_to_store = extracted_content
-                                        else:
-                                            key_to_store = extracted_content
-                                            value_to_store = keyword
-
-                                        # 插入偏好记录，利用唯一约束避免重复
-                                        if self.insert_preference(category, key_to_store, value_to_store, conv_id):
-                                            new_preferences_count += 1
-
-                            except Exception as e:
-                                print(f"处理句子时出错: {user_input}, 错误: {e}")
-                            break  # 一个对话只匹配一个关键词
+                # 一次扫描找出每个类别中第一个命中的关键词
+                for category, keyword, keyword_index in self.matcher.match(user_input):
+                    try:
+                        content_after_keyword = user_input[keyword_index + len(keyword):].strip()
+
+                        # 提取关键词后的内容（取第一个短语）
+                        if content_after_keyword:
+                            # 简单的分割，取第一个有意义的片段
+                            extracted_content = content_after_keyword.split('。')[0].split('，')[0].split(' ')[0]
+                            extracted_content = extracted_content[:20]  # 限制长度
+
+                            if extracted_content and len(extracted_content) > 0:
+                                if category == 'fact' and ('名字' in keyword or '叫我' in keyword):
+                                    key_to_store = 'user_name'
+                                    value_to_store = extracted_content
+                                else:
+                                    key_to_store = extracted_content
+                                    value_to_store = keyword
+
+                                candidates.append((category, key_to_store, value_to_store, conv_id))
+
+                    except Exception as e:
+                        print(f"处理句子时出错: {user_input}, 错误: {e}")
+
+            # 同一个事务中写入偏好并更新挖掘游标，下次只分析之后的新对话
+            with self.connections.connection(self.db_path) as conn:
+                new_preferences_count = self._insert_preferences(conn, candidates)
+                conn.executemany(
+                    "INSERT OR REPLACE INTO META (key, value) VALUES (?, ?)",
+                    [('mining_last_id', str(all_conversations[-1][0])),
+                     ('mining_rules_version', rules_version)]
+                )
 
             if new_preferences_count > 0:
                 return new_preferences_count, f"成功挖掘到 {new_preferences_count} 条新偏好！"
@@ -140,92 +741,234 @@ class DatabaseManager:
         except Exception as e:
             return 0, f"挖掘偏好时出错: {str(e)}"
 
+    def _insert_preferences(self, conn, rows):
+        """在已有连接上批量插入偏好，返回真正新增的条数（被唯一约束忽略的不算）"""
+        if not rows:
+            return 0
+        before = conn.total_changes
+        conn.executemany(
+            "INSERT OR IGNORE INTO PREFERENCES (category, key_text, value_text, source_ID) VALUES (?, ?, ?, ?)",
+            rows
+        )
+        inserted = conn.total_changes - before
+        if inserted:
+            self.invalidate_preferences_cache()
+        return inserted
+
+    def insert_preferences(self, rows):
+        """在一个事务中批量插入偏好 [(category, key_text, value_text, source_id), ...]，返回新增条数"""
+        try:
+            with self.connections.connection(self.db_path) as conn:
+                return self._insert_preferences(conn, rows)
+        except Exception as e:
+            print(f"批量插入偏好数据时出错: {e}")
+            return 0
+
     def insert_preference(self, category, key_text, value_text, source_id):
-        """向偏好表插入一条新记录（内部方法）"""
+        """向偏好表插入一条新记录（内部方法） - 只有真正新增时才返回True"""
         try:
-            conn = sqlite3.connect(self.preferences_db_path)
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT OR IGNORE INTO PREFERENCES (category, key_text, value_text, source_ID) VALUES (?, ?, ?, ?)",
-                (category, key_text, value_text, source_id)
-            )
-            conn.commit()
-            conn.close()
-            return True
+            with self.connections.connection(self.db_path) as conn:
+                return self._insert_preferences(conn, [(category, key_text, value_text, source_id)]) > 0
         except Exception as e:
             print(f"插入偏好数据时出错: {e}")
             return False
 
-    def get_user_preferences(self):
-        """获取用户偏好"""
-        try:
-            conn = sqlite3.connect(self.preferences_db_path)
+    def invalidate_preferences_cache(self):
+        """偏好表发生变化，下次获取偏好时重新渲染"""
+        self._preferences_generation += 1
+
+    def render_preference(self, category, key, value):
+        """把一条偏好渲染成提示词中的一行"""
+        if category == 'fact' and key == 'user_name':
+            return f"- 用户的名字叫{value}"
+        elif category == 'fact' and key == 'ai_name':
+            return f"- 你（AI）的名字是{value}"
+        elif category == 'like':
+            return f"- 用户{value}{key}"
+        elif category == 'hobby':
+            return f"- 用户{value}{key}"
+        else:
+            return f"- 用户的{key}是{value}"
+
+    def _load_preferences(self):
+        """读取全部偏好及渲染好的文本 - 偏好表没有变化时直接返回缓存"""
+        with self.connections.connection(self.db_path) as conn:
+            # 版本号在连接锁内读取，写入方也在锁内递增，保证缓存与查询结果一致
+            generation = self._preferences_generation
+            data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+            cache = self._preferences_cache
+            if cache and cache[0] == generation and cache[1] == data_version:
+                return cache[2], cache[3]
+
             cursor = conn.cursor()
             cursor.execute("SELECT category, key_text, value_text FROM PREFERENCES")
             preferences = cursor.fetchall()
 
-            if not preferences:
-                return "目前还没有记录任何用户偏好信息。"
-
-            memory_text = "以下是你已知的关于用户的信息：\n"
-            for category, key, value in preferences:
-                if category == 'fact' and key == 'user_name':
-                    memory_text += f"- 用户的名字叫{value}\n"
-                elif category == 'fact' and key == 'ai_name':
-                    memory_text += f"- 你（AI）的名字是{value}\n"
-                elif category == 'like':
-                    memory_text += f"- 用户{value}{key}\n"
-                elif category == 'hobby':
-                    memory_text += f"- 用户{value}{key}\n"
-                else:
-                    memory_text += f"- 用户的{key}是{value}\n"
-
-            return memory_text
+        memory_text = self.format_preferences(
+            [self.render_preference(category, key, value) for category, key, value in preferences]
+        )
+        self._preferences_cache = (generation, data_version, preferences, memory_text)
+        return preferences, memory_text
+
+    PREFERENCES_HEADER = "以下是你已知的关于用户的信息："
+
+    def format_preferences(self, lines):
+        """把渲染好的偏好行组装成提示词中的记忆段落"""
+        if not lines:
+            return "目前还没有记录任何用户偏好信息。"
+        return "\n".join([self.PREFERENCES_HEADER] + lines) + "\n"
+
+    def get_user_preferences(self):
+        """获取用户偏好 - 偏好表没有变化时直接返回缓存的文本"""
+        try:
+            return self._load_preferences()[1]
         except Exception as e:
             print(f"获取用户偏好时出错: {e}")  # 调试信息
             return "目前还没有记录任何用户偏好信息。"
 
-    def save_conversation(self, user_input, ai_response):
-        """保存对话记录"""
+    def get_relevant_preferences(self, query, max_chars=None):
+        """获取与当前输入最相关的用户偏好，总长度不超过字数预算
+
+        用户名、AI名字总是保留，其余偏好按与 query 的相关度排序后依次放入。
+        """
+        if max_chars is None:
+            max_chars = self.preference_char_budget
         try:
-            conn = sqlite3.connect(self.memory_db_path)
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO MEMORY (user_input, AI_output) VALUES (?, ?)",
-                (user_input, ai_response)
-            )
-            conn.commit()
-            conn.close()
+            preferences, memory_text = self._load_preferences()
+            if len(memory_text) <= max_chars:
+                # 全部偏好都放得下，不需要筛选
+                return memory_text
+
+            retriever = self._retriever
+            if retriever is None or retriever.rows is not preferences:
+                retriever = PreferenceRetriever(preferences)
+                self._retriever = retriever
+
+            # 预算扣除标题行后留给偏好条目
+            lines_budget = max_chars - len(self.PREFERENCES_HEADER) - 1
+            return self.format_preferences(retriever.select(query, self.render_preference, lines_budget))
+        except Exception as e:
+            print(f"获取相关偏好时出错: {e}")  # 调试信息
+            return "目前还没有记录任何用户偏好信息。"
+
+    def get_preferences_version(self):
+        """偏好表的版本：本进程修改时递增的版本号 + PRAGMA data_version（其他程序修改时变化）
+
+        偏好内容不变时版本不变，可以用来判断上一轮放进提示词的偏好是否还有效。
+        """
+        try:
+            with self.connections.connection(self.db_path) as conn:
+                return self._preferences_generation, conn.execute("PRAGMA data_version").fetchone()[0]
+        except Exception as e:
+            print(f"读取偏好版本时出错: {e}")  # 调试信息
+            return None
+
+    def get_conversation_summary(self):
+        """读取滚动对话摘要（较早对话的压缩），没有时返回空字符串"""
+        return self.get_meta('conversation_summary', '')
+
+    def get_turns_to_summarize(self, keep_recent=2, limit=20):
+        """返回还没有并入摘要的对话 [(ID, user_input, AI_output), ...]，按时间顺序
+
+        最近的 keep_recent 轮会原样放进提示词，不需要摘要；
+        积压很多时只取其中最近的 limit 轮（更早的对话仍可通过记忆检索找到）。
+        行程提醒和导入的对话不是这次聊天的内容，不参与摘要。
+        """
+        try:
+            last_id = int(self.get_meta('summary_last_id', 0))
+            with self.connections.connection(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "SELECT ID, user_input, AI_output FROM MEMORY "
+                    "WHERE ID > ? AND (source IS NULL OR source = 'chat') ORDER BY ID DESC LIMIT ?",
+                    (last_id, keep_recent + limit)
+                )
+                rows = cursor.fetchall()
+            return list(reversed(rows[keep_recent:]))
+        except Exception as e:
+            print(f"读取待摘要的对话时出错: {e}")  # 调试信息
+            return []
+
+    def save_conversation_summary(self, summary, last_id):
+        """在同一个事务中保存新的摘要和已摘要到的对话ID"""
+        try:
+            with self.connections.connection(self.db_path) as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO META (key, value) VALUES (?, ?)",
+                    [('conversation_summary', summary),
+                     ('summary_last_id', str(last_id))]
+                )
+            return True
+        except Exception as e:
+            print(f"保存对话摘要时出错: {e}")  # 调试信息
+            return False
+
+    def save_conversation(self, user_input, ai_response, source='chat'):
+        """保存对话记录，source 为 'chat'（普通对话）或 'schedule'（行程提醒）"""
+        try:
+            with self.connections.connection(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "INSERT INTO MEMORY (user_input, AI_output, source) VALUES (?, ?, ?)",
+                    (user_input, ai_response, source)
+                )
             print(f"对话保存成功: {user_input[:20]}...")  # 调试信息
             return True
         except Exception as e:
             print(f"保存对话时出错：{e}")  # 调试信息
             return False
 
+    # 需要走索引的查询，查询计划由 in_computer/bench/查询计划检查.py 检查
+    QUERY_SQL = {
+        'upcoming_schedules': "SELECT event_time, event_name FROM SCHEDULE "
+                              "WHERE event_time >= ? AND event_time < ? ORDER BY event_time",
+        'all_schedules': "SELECT ID, event_time, event_name, created_time FROM SCHEDULE ORDER BY event_time",
+        'recent_memories': "SELECT user_input, AI_output, timestamp FROM MEMORY ORDER BY timestamp DESC LIMIT ?",
+        'preferences_by_category': "SELECT category, key_text, value_text FROM PREFERENCES ORDER BY category",
+    }
+
+    # 行程时间统一保存为本地时间 'YYYY-MM-DD HH:MM'，按文本排序就是按时间排序
+    EVENT_TIME_FORMAT = '%Y-%m-%d %H:%M'
+
+    def normalize_event_time(self, event_time, now=None):
+        """把只有时分的行程时间（如 14:30、9:05）换成最近一次到来的完整时间，其他格式原样返回"""
+        match = re.fullmatch(r'(\d{1,2}):(\d{2})', event_time.strip())
+        if not match:
+            return event_time
+        now = now or datetime.now()
+        try:
+            event = now.replace(hour=int(match.group(1)), minute=int(match.group(2)), second=0, microsecond=0)
+        except ValueError:
+            return event_time
+        if event < now.replace(second=0, microsecond=0):
+            # 今天的这个时刻已经过了，指的是明天
+            event += timedelta(days=1)
+        return event.strftime(self.EVENT_TIME_FORMAT)
+
     def add_schedule(self, event_time, event_name):
         """添加新行程"""
         try:
-            conn = sqlite3.connect(self.schedule_db_path)
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO SCHEDULE (event_time, event_name) VALUES (?, ?)",
-                (event_time, event_name)
-            )
-            conn.commit()
-            conn.close()
+            with self.connections.connection(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "INSERT INTO SCHEDULE (event_time, event_name) VALUES (?, ?)",
+                    (self.normalize_event_time(event_time), event_name)
+                )
             return True
         except Exception as e:
             print(f"添加行程时出错：{e}")
             return False
 
-    def get_upcoming_schedules(self, hours=24):
-        """获取即将到来的行程 - 简化版本，返回所有行程"""
+    def get_upcoming_schedules(self, hours=24, now=None):
+        """获取接下来 hours 小时内的行程（从当前这一分钟开始），按时间排序"""
+        now = (now or datetime.now()).replace(second=0, microsecond=0)
+        start = now.strftime(self.EVENT_TIME_FORMAT)
+        end = (now + timedelta(hours=hours)).strftime(self.EVENT_TIME_FORMAT)
         try:
-            conn = sqlite3.connect(self.schedule_db_path)
-            cursor = conn.cursor()
-            cursor.execute("SELECT event_time, event_name FROM SCHEDULE ORDER BY event_time")
-            schedules = cursor.fetchall()
-            conn.close()
+            with self.connections.connection(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute(self.QUERY_SQL['upcoming_schedules'], (start, end))
+                schedules = cursor.fetchall()
             return schedules
         except Exception as e:
             print(f"获取行程时出错：{e}")
@@ -234,26 +977,21 @@ class DatabaseManager:
     def get_all_data(self):
         """获取所有数据用于调试查看"""
         try:
-            # 获取记忆
-            conn = sqlite3.connect(self.memory_db_path)
-            cursor = conn.cursor()
-            cursor.execute("SELECT user_input, AI_output, timestamp FROM MEMORY ORDER BY timestamp DESC LIMIT 10")
-            memories = cursor.fetchall()
-            conn.close()
+            # 三张表在同一个连接上读取
+            with self.connections.connection(self.db_path) as conn:
+                cursor = conn.cursor()
 
-            # 获取偏好
-            conn = sqlite3.connect(self.preferences_db_path)
-            cursor = conn.cursor()
-            cursor.execute("SELECT category, key_text, value_text FROM PREFERENCES")
-            preferences = cursor.fetchall()
-            conn.close()
+                # 获取记忆
+                cursor.execute(self.QUERY_SQL['recent_memories'], (10,))
+                memories = cursor.fetchall()
 
-            # 获取行程
-            conn = sqlite3.connect(self.schedule_db_path)
-            cursor = conn.cursor()
-            cursor.execute("SELECT ID, event_time, event_name, created_time FROM SCHEDULE ORDER BY event_time")
-            schedules = cursor.fetchall()
-            conn.close()
+                # 获取偏好（同一类别的排在一起）
+                cursor.execute(self.QUERY_SQL['preferences_by_category'])
+                preferences = cursor.fetchall()
+
+                # 获取行程
+                cursor.execute(self.QUERY_SQL['all_schedules'])
+                schedules = cursor.fetchall()
 
             return {
                 'memories': memories,
@@ -264,176 +1002,320 @@ class DatabaseManager:
             print(f"获取所有数据时出错: {e}")  # 调试信息
             return {'error': str(e)}
 
+    def get_db_path(self, db_type):
+        """根据数据类型返回数据库文件路径（所有类型都在同一个文件中），未知类型返回None"""
+        return self.db_path if db_type in self.LEGACY_TABLES else None
+
     def check_table_exists(self, db_path, table_name):
         """检查表是否存在"""
         try:
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'")
-            result = cursor.fetchone()
-            conn.close()
+            with self.connections.connection(db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
+                result = cursor.fetchone()
             return result is not None
         except Exception as e:
             print(f"检查表存在性时出错: {e}")
             return False
 
-    def import_from_json(self, db_type, data):
-        """从JSON数据导入到指定数据库 - 修复版本"""
-        try:
-            count = 0
+    # 各数据库导入时使用的插入语句
+    # 导出文件中带有时间字段时保留原时间，便于多设备同步后仍按时间排序
+    IMPORT_SQL = {
+        'memory': "INSERT INTO MEMORY (user_input, AI_output, timestamp, source) "
+                  "VALUES (?, ?, COALESCE(?, CURRENT_TIMESTAMP), 'import')",
+        'preferences': "INSERT OR IGNORE INTO PREFERENCES (category, key_text, value_text, source_ID) VALUES (?, ?, ?, ?)",
+        'schedule': "INSERT INTO SCHEDULE (event_time, event_name, created_time) VALUES (?, ?, COALESCE(?, CURRENT_TIMESTAMP))",
+    }
 
-            if db_type == "memory":
-                # 导入对话记忆
-                for item in data:
-                    if isinstance(item, dict) and 'user_input' in item and 'ai_output' in item:
-                        success = self.save_conversation(item['user_input'], item['ai_output'])
-                        if success:
-                            count += 1
-                    elif isinstance(item, dict) and 'user_input' in item and 'AI_output' in item:
-                        # 兼容不同大小写的字段名
-                        success = self.save_conversation(item['user_input'], item['AI_output'])
-                        if success:
-                            count += 1
-                    elif isinstance(item, (list, tuple)) and len(item) >= 2:
-                        success = self.save_conversation(str(item[0]), str(item[1]))
-                        if success:
-                            count += 1
+    def normalize_import_item(self, db_type, item):
+        """把一条导入数据规范化为插入用的元组，格式不支持、缺少必填字段或行程时间无法识别时返回None
 
+        JSON对象中的必填字段必须是字符串；数组格式沿用按位置转成字符串的做法，但不接受null。
+        """
+        if isinstance(item, dict):
+            if db_type == "memory":
+                ai_output = item['ai_output'] if 'ai_output' in item else item.get('AI_output')  # 兼容不同大小写的字段名
+                row = (item.get('user_input'), ai_output, item.get('timestamp'))
+                required = row[:2]
             elif db_type == "preferences":
-                # 导入用户偏好
-                for item in data:
-                    if isinstance(item, dict) and all(key in item for key in ['category', 'key_text', 'value_text']):
-                        # 使用现有方法插入偏好
-                        source_id = item.get('source_ID', None)
-                        success = self.insert_preference(
-                            item['category'],
-                            item['key_text'],
-                            item['value_text'],
-                            source_id
-                        )
-                        if success:
-                            count += 1
-                    elif isinstance(item, (list, tuple)) and len(item) >= 3:
-                        source_id = item[3] if len(item) > 3 else None
-                        success = self.insert_preference(
-                            str(item[0]), str(item[1]), str(item[2]), source_id
-                        )
-                        if success:
-                            count += 1
-
+                row = (item.get('category'), item.get('key_text'), item.get('value_text'), item.get('source_ID'))
+                required = row[:2]
+                if row[2] is not None and not isinstance(row[2], str):
+                    return None
             elif db_type == "schedule":
-                # 导入行程安排
-                for item in data:
-                    if isinstance(item, dict) and all(key in item for key in ['event_time', 'event_name']):
-                        success = self.add_schedule(item['event_time'], item['event_name'])
-                        if success:
-                            count += 1
-                    elif isinstance(item, dict) and 'event_time' in item and 'event_name' in item:
-                        # 兼容不同大小写的字段名
-                        success = self.add_schedule(item['event_time'], item['event_name'])
-                        if success:
-                            count += 1
-                    elif isinstance(item, (list, tuple)) and len(item) >= 2:
-                        success = self.add_schedule(str(item[0]), str(item[1]))
-                        if success:
-                            count += 1
+                row = (item.get('event_time'), item.get('event_name'), item.get('created_time'))
+                required = row[:2]
             else:
-                return {'success': False, 'error': f'未知的数据库类型: {db_type}'}
+                return None
+            if not all(isinstance(value, str) for value in required):
+                return None
 
-            return {'success': True, 'count': count}
+        elif isinstance(item, (list, tuple)):
+            count = 3 if db_type == "preferences" else 2
+            if db_type not in self.IMPORT_SQL or len(item) < count or any(value is None for value in item[:count]):
+                return None
+            if db_type == "preferences":
+                source_id = item[3] if len(item) > 3 else None
+                row = (str(item[0]), str(item[1]), str(item[2]), source_id)
+            else:
+                row = (str(item[0]), str(item[1]), None)
+
+        else:
+            return None
+
+        if db_type == "schedule":
+            event_time = self.normalize_import_event_time(row[0], row[2])
+            if event_time is None:
+                return None
+            row = (event_time,) + row[1:]
+        return row
+
+    # 导入数据中可以识别的创建时间格式（与 CURRENT_TIMESTAMP 一样是UTC时间）
+    CREATED_TIME_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M']
+
+    def normalize_import_event_time(self, event_time, created_time=None):
+        """把导入的行程时间规范化为 EVENT_TIME_FORMAT，无法识别时返回None
+
+        只有时分的时间按这条行程的创建时间推算日期（与版本3迁移的规则一致），没有创建时间时按现在推算；
+        带秒的完整时间去掉秒。创建时间本身无法识别时也返回None。
+        """
+        now = None
+        if created_time is not None:
+            for fmt in self.CREATED_TIME_FORMATS:
+                try:
+                    created = datetime.strptime(str(created_time).strip(), fmt)
+                    break
+                except ValueError:
+                    continue
+            else:
+                return None
+            now = created.replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+
+        event_time = self.normalize_event_time(event_time, now).strip()
+        for fmt in (self.EVENT_TIME_FORMAT, '%Y-%m-%d %H:%M:%S'):
+            try:
+                return datetime.strptime(event_time, fmt).strftime(self.EVENT_TIME_FORMAT)
+            except ValueError:
+                continue
+        return None
+
+    def import_from_json(self, db_type, data, progress_callback=None, chunk_size=1000, on_chunk=None):
+        """从JSON数据导入到指定数据库 - 批量写入版本
+
+        data 可以是列表或任意可迭代对象。数据先逐条规范化，再按 chunk_size 分批
+        executemany，每批单独提交：写锁只在一批内持有，导入很大时对话保存等写入也不用等整个导入结束。
+        出错时只回滚当前这一批，之前的批次保留，返回结果中的 count 是已写入的条数。
+        on_chunk(conn) 在每批提交前调用，可以在同一事务中记录进度（例如JSON Lines的文件位置）。
+        每写完一批调用一次 progress_callback(已处理条数)。
+        """
+        if db_type not in self.IMPORT_SQL:
+            return {'success': False, 'error': f'未知的数据库类型: {db_type}'}
+
+        db_path = self.get_db_path(db_type)
+        sql = self.IMPORT_SQL[db_type]
+
+        count = 0
+        processed = 0
+        skipped = 0
+        chunk = []
+        try:
+            # 导入可能很久，在单独的连接上写入，期间对话时的读取不受影响
+            with self.connections.dedicated(db_path) as conn:
+                def flush():
+                    nonlocal count
+                    cursor = conn.executemany(sql, chunk)
+                    if on_chunk:
+                        on_chunk(conn)
+                    conn.commit()
+                    sleep(self.BATCH_PAUSE)
+                    # 偏好表可能因唯一约束忽略重复数据，只统计真正写入的条数；
+                    # 全文索引触发器的写入也会计入total_changes，这里用rowcount统计
+                    count += cursor.rowcount
+                    if db_type == 'preferences':
+                        self.invalidate_preferences_cache()
+                    chunk.clear()
+                    if progress_callback:
+                        progress_callback(processed)
+
+                for item in data:
+                    processed += 1
+                    row = self.normalize_import_item(db_type, item)
+                    if row is None:
+                        skipped += 1
+                        continue
+                    chunk.append(row)
+                    if len(chunk) >= chunk_size:
+                        flush()
+
+                if chunk:
+                    flush()
+
+            return {'success': True, 'count': count, 'skipped': skipped}
 
         except Exception as e:
             print(f"导入数据时出错: {e}")  # 调试信息
+            if count:
+                print(f"出错前已导入 {count} 条")  # 调试信息
+            return {'success': False, 'error': str(e), 'count': count, 'skipped': skipped}
+
+    def import_from_json_file(self, db_type, file_path, progress_callback=None):
+        """从JSON文件导入 - 边解析边分批写入，格式错误时之前写入的批次保留"""
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                return self.import_from_json(db_type, iter_array(f), progress_callback)
+        except Exception as e:
+            print(f"读取导入文件时出错: {e}")  # 调试信息
             return {'success': False, 'error': str(e)}
 
-    def export_to_json(self, db_type, file_path):
-        """将指定数据库导出为JSON文件"""
+    def import_from_jsonl_file(self, db_type, file_path, progress_callback=None):
+        """从JSON Lines文件导入 - 记住上次导入到的位置，文件被追加后只导入新增的行
+
+        导入位置随每批数据在同一事务中保存，中途出错后再次导入会从最后提交的一批之后继续。
+        """
+        offset_key = f"jsonl_import:{db_type}:{os.path.abspath(file_path)}"
         try:
-            data = []
+            offset = int(self.get_meta(offset_key, 0))
+            if offset > os.path.getsize(file_path):
+                # 文件被重新生成（变短了），从头导入
+                offset = 0
 
-            if db_type == "memory":
-                # 导出对话记忆
-                conn = sqlite3.connect(self.memory_db_path)
-                cursor = conn.cursor()
-                cursor.execute("SELECT user_input, AI_output, timestamp FROM MEMORY")
-                rows = cursor.fetchall()
-                conn.close()
+            with open(file_path, 'rb') as f:
+                f.seek(offset)
 
-                for row in rows:
-                    data.append({
-                        'user_input': row[0],
-                        'ai_output': row[1],
-                        'timestamp': row[2]
-                    })
+                def save_offset(conn):
+                    # 每批最后一条刚被读出，文件位置正好在它所在行之后
+                    conn.execute("INSERT OR REPLACE INTO META (key, value) VALUES (?, ?)",
+                                 (offset_key, str(f.tell())))
 
-            elif db_type == "preferences":
-                # 导出用户偏好
-                conn = sqlite3.connect(self.preferences_db_path)
+                result = self.import_from_json(db_type, iter_lines(f), progress_callback, on_chunk=save_offset)
+                if result.get('success'):
+                    self.set_meta(offset_key, f.tell())
+            return result
+        except Exception as e:
+            print(f"读取导入文件时出错: {e}")  # 调试信息
+            return {'success': False, 'error': str(e)}
+
+    def import_from_file(self, db_type, file_path, progress_callback=None):
+        """根据扩展名选择导入格式：.jsonl 为JSON Lines，其余按JSON数组处理"""
+        if file_path.endswith('.jsonl'):
+            return self.import_from_jsonl_file(db_type, file_path, progress_callback)
+        return self.import_from_json_file(db_type, file_path, progress_callback)
+
+    # 各数据库导出时的表名、列、JSON字段名以及时间列
+    EXPORT_TABLES = {
+        'memory': ('MEMORY', ['user_input', 'AI_output', 'timestamp'],
+                   ['user_input', 'ai_output', 'timestamp'], 'timestamp'),
+        'preferences': ('PREFERENCES', ['category', 'key_text', 'value_text', 'source_ID'],
+                        ['category', 'key_text', 'value_text', 'source_ID'], None),
+        'schedule': ('SCHEDULE', ['event_time', 'event_name', 'created_time'],
+                     ['event_time', 'event_name', 'created_time'], 'created_time'),
+    }
+
+    def export_to_json(self, db_type, file_path, compact=False):
+        """将指定数据库导出为JSON文件 - 分批读取并逐条写入，内存占用与数据量无关
+
+        compact=True 时不缩进，文件更小。
+        """
+        if db_type not in self.EXPORT_TABLES:
+            return {'success': False, 'error': f'未知的数据库类型: {db_type}'}
+
+        table, columns, keys, _ = self.EXPORT_TABLES[db_type]
+        temp_path = file_path + '.tmp'
+        try:
+            # 边读边写文件，在只读连接上进行，不阻塞对话时的其他查询
+            with self.connections.dedicated(self.get_db_path(db_type), read_only=True) as conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT category, key_text, value_text, source_ID FROM PREFERENCES")
-                rows = cursor.fetchall()
-                conn.close()
+                cursor.execute(f"SELECT {', '.join(columns)} FROM {table}")
 
-                for row in rows:
-                    data.append({
-                        'category': row[0],
-                        'key_text': row[1],
-                        'value_text': row[2],
-                        'source_ID': row[3]
-                    })
+                # 先写临时文件，完成后再替换，避免导出中断留下半个文件
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    count = dump_array(iter_cursor_dicts(cursor, keys), f, indent=None if compact else 2)
 
-            elif db_type == "schedule":
-                # 导出行程安排
-                conn = sqlite3.connect(self.schedule_db_path)
+            os.replace(temp_path, file_path)
+            return {'success': True, 'count': count}
+
+        except Exception as e:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return {'success': False, 'error': str(e)}
+
+    def export_to_jsonl(self, db_type, file_path, since_id=None, since_time=None):
+        """导出为JSON Lines文件，每行一条记录并带上ID
+
+        指定 since_id / since_time 时只导出该ID / 时间之后的记录并覆盖文件；
+        都不指定时为增量同步：文件已存在且记录过导出位置时，只把上次导出之后的新记录追加到末尾；
+        没有记录（例如文件是别处复制来的）时不知道文件里有哪些记录，覆盖文件重新完整导出，避免重复。
+        """
+        if db_type not in self.EXPORT_TABLES:
+            return {'success': False, 'error': f'未知的数据库类型: {db_type}'}
+
+        table, columns, keys, time_column = self.EXPORT_TABLES[db_type]
+        if since_time is not None and time_column is None:
+            return {'success': False, 'error': f'{db_type}数据库没有时间字段，只能按ID导出'}
+
+        cursor_key = f"jsonl_export:{db_type}:{os.path.abspath(file_path)}"
+        mode = 'w'
+        if since_id is None and since_time is None and os.path.exists(file_path):
+            last_exported = self.get_meta(cursor_key)
+            if last_exported is not None:
+                since_id = int(last_exported)
+                mode = 'a'
+
+        sql = f"SELECT ID, {', '.join(columns)} FROM {table} WHERE ID > ?"
+        params = [since_id or 0]
+        if since_time is not None:
+            # 时间列是DATETIME（数值亲和性），按文本比较才能支持 '2024' 这类只写年份的时间
+            sql += f" AND CAST({time_column} AS TEXT) > ?"
+            params.append(since_time)
+        sql += " ORDER BY ID"
+
+        try:
+            last_id = since_id or 0
+            with self.connections.dedicated(self.get_db_path(db_type), read_only=True) as conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT event_time, event_name, created_time FROM SCHEDULE")
-                rows = cursor.fetchall()
-                conn.close()
-
-                for row in rows:
-                    data.append({
-                        'event_time': row[0],
-                        'event_name': row[1],
-                        'created_time': row[2]
-                    })
-            else:
-                return {'success': False, 'error': f'未知的数据库类型: {db_type}'}
+                cursor.execute(sql, params)
+
+                def rows():
+                    nonlocal last_id
+                    for item in iter_cursor_dicts(cursor, ['ID'] + keys):
+                        last_id = item['ID']
+                        yield item
 
-            # 写入JSON文件
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+                with open(file_path, mode, encoding='utf-8') as f:
+                    count = dump_lines(rows(), f)
 
-            return {'success': True, 'count': len(data)}
+            self.set_meta(cursor_key, last_id)
+            return {'success': True, 'count': count, 'last_id': last_id}
 
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    def export_to_file(self, db_type, file_path):
+        """根据扩展名选择导出格式：.jsonl 为增量追加的JSON Lines，其余为JSON数组"""
+        if file_path.endswith('.jsonl'):
+            return self.export_to_jsonl(db_type, file_path)
+        return self.export_to_json(db_type, file_path)
+
     # 辅助方法：获取所有数据（用于调试）
     def get_all_data_for_export(self, db_type):
         """获取指定数据库的所有数据（用于导出）"""
         if db_type == "memory":
-            conn = sqlite3.connect(self.memory_db_path)
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM MEMORY")
-            data = cursor.fetchall()
-            conn.close()
-            return data
+            with self.connections.connection(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT * FROM MEMORY")
+                return cursor.fetchall()
 
         elif db_type == "preferences":
-            conn = sqlite3.connect(self.preferences_db_path)
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM PREFERENCES")
-            data = cursor.fetchall()
-            conn.close()
-            return data
+            with self.connections.connection(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT * FROM PREFERENCES")
+                return cursor.fetchall()
 
         elif db_type == "schedule":
-            conn = sqlite3.connect(self.schedule_db_path)
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM SCHEDULE")
-            data = cursor.fetchall()
-            conn.close()
-            return data
+            with self.connections.connection(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT * FROM SCHEDULE")
+                return cursor.fetchall()
 
         else:
             return []
@@ -441,20 +1323,18 @@ class DatabaseManager:
     def delete_schedule(self, schedule_id):
         """根据ID删除行程"""
         try:
-            conn = sqlite3.connect(self.schedule_db_path)
-            cursor = conn.cursor()
+            with self.connections.connection(self.db_path) as conn:
+                cursor = conn.cursor()
 
-            # 先检查行程是否存在
-            cursor.execute("SELECT event_time, event_name FROM SCHEDULE WHERE ID = ?", (schedule_id,))
-            schedule = cursor.fetchone()
+                # 先检查行程是否存在
+                cursor.execute("SELECT event_time, event_name FROM SCHEDULE WHERE ID = ?", (schedule_id,))
+                schedule = cursor.fetchone()
 
-            if not schedule:
-                return False, "行程不存在"
+                if not schedule:
+                    return False, "行程不存在"
 
-            # 删除行程
-            cursor.execute("DELETE FROM SCHEDULE WHERE ID = ?", (schedule_id,))
-            conn.commit()
-            conn.close()
+                # 删除行程
+                cursor.execute("DELETE FROM SCHEDULE WHERE ID = ?", (schedule_id,))
 
             return True, f"已删除行程: {schedule[0]} - {schedule[1]}"
 
@@ -464,8 +1344,10 @@ class DatabaseManager:
     def get_conversations(self):
         """获取所有对话记录 - 确保返回一致的字段"""
         try:
-            self.cursor.execute("SELECT user_input, ai_response FROM conversations ORDER BY timestamp DESC LIMIT 50")
-            return self.cursor.fetchall()
+            with self.connections.connection(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT user_input, AI_output FROM MEMORY ORDER BY timestamp DESC LIMIT 50")
+                return cursor.fetchall()
         except Exception as e:
             print(f"获取对话记录错误: {e}")
             return []
@@ -473,10 +1355,14 @@ class DatabaseManager:
     def get_all_schedules(self):
         """获取所有行程 - 确保返回一致的字段"""
         try:
-            self.cursor.execute("SELECT schedule_time, event FROM schedules ORDER BY schedule_time")
-            return self.cursor.fetchall()
+            with self.connections.connection(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT event_time, event_name FROM SCHEDULE ORDER BY event_time")
+                return cursor.fetchall()
         except Exception as e:
             print(f"获取行程错误: {e}")
             return []
 
-
+    def close(self):
+        """关闭所有数据库长连接（应用退出时调用）"""
+        self.connections.close_all()
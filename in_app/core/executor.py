@@ -0,0 +1,217 @@
+import heapq
+import itertools
+import threading
+
+# 优先级：数字越小越先执行
+PRIORITY_CHAT = 0        # 对话回复，用户正在等待
+PRIORITY_USER = 1        # 用户点击按钮触发的操作（查看数据、行程提醒等）
+PRIORITY_IMPORT = 2      # 导入导出，耗时较长
+PRIORITY_BACKGROUND = 3  # 后台维护（生成向量、对话摘要、模型续期）
+
+_local = threading.local()
+
+
+def current_task():
+    """返回当前工作线程正在执行的任务，不在任务中时返回 None"""
+    return getattr(_local, 'task', None)
+
+
+class Task:
+    """提交给 TaskExecutor 的一个任务
+
+    任务被同 key 的新任务取代时会被标记为取消：还没开始的直接丢弃，
+    正在运行的由任务自己通过 is_cancelled() 检查后提前结束。
+    """
+
+    def __init__(self, func, args, kwargs, priority, key, on_done, on_error):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.key = key
+        self.on_done = on_done
+        self.on_error = on_error
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+
+class TaskExecutor:
+    """所有后台工作的统一执行器：固定数量的工作线程 + 优先级队列
+
+    - 按优先级执行，同一优先级先提交先执行
+    - 同一个 key 的任务不会同时运行；提交新任务时，同 key 还在排队的旧任务被丢弃，
+      正在运行的旧任务被标记取消，新任务等它结束后再开始
+    - 排队的任务达到 max_pending 时，新任务只能挤掉排队中的后台任务，否则被拒绝（submit 返回 None），
+      调用方据此提示用户稍后再试，而不是无限堆积线程
+    - 后台任务最多同时占用 workers - 1 个线程，至少留一个线程给对话和用户操作，
+      否则几个耗时的后台任务（模型续期、生成向量、摘要）可能让对话等上几分钟
+    """
+
+    def __init__(self, workers=3, max_pending=32):
+        self.max_pending = max_pending
+        self.max_background = max(1, workers - 1)
+        self._background_running = 0
+        self._running_priorities = []  # 正在运行的任务的优先级（用于判断是否空闲）
+        self._heap = []
+        self._counter = itertools.count()
+        self._pending = {}   # 排队中的任务 -> True（用于计数和淘汰）
+        self._latest = {}    # key -> 排队中该 key 最新的任务
+        self._running = {}   # key -> 正在运行的任务
+        self._parked = {}    # key -> 等待同 key 任务结束后再排队的任务
+        self._condition = threading.Condition()
+        self._shutdown = False
+
+        self._threads = []
+        for index in range(workers):
+            thread = threading.Thread(target=self._worker, name=f"task-worker-{index}")
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, func, *args, priority=PRIORITY_USER, key=None, on_done=None, on_error=None, **kwargs):
+        """提交任务，返回 Task；队列已满被拒绝时返回 None
+
+        on_done(result) / on_error(exception) 在工作线程中调用，需要更新界面时由调用方转回主线程。
+        """
+        task = Task(func, args, kwargs, priority, key, on_done, on_error)
+        with self._condition:
+            if self._shutdown:
+                return None
+
+            if key is not None:
+                for previous in (self._latest.pop(key, None), self._parked.pop(key, None)):
+                    if previous is not None:
+                        self._drop(previous)
+                running = self._running.get(key)
+                if running is not None:
+                    running.cancel()
+
+            if len(self._pending) >= self.max_pending and not self._evict_for(priority):
+                print(f"任务队列已满，拒绝任务: {getattr(func, '__name__', func)}")
+                return None
+
+            self._push(task)
+            self._condition.notify()
+        return task
+
+    def _push(self, task):
+        self._pending[task] = True
+        if task.key is not None:
+            self._latest[task.key] = task
+        heapq.heappush(self._heap, (task.priority, next(self._counter), task))
+
+    def _drop(self, task):
+        """丢弃排队中的任务（调用方持有锁）"""
+        task.cancel()
+        self._pending.pop(task, None)
+
+    def _evict_for(self, priority):
+        """队列满时为更重要的任务腾出位置：淘汰一个排队中的后台任务（调用方持有锁）"""
+        if priority >= PRIORITY_BACKGROUND:
+            return False
+        for task in self._pending:
+            if task.priority >= PRIORITY_BACKGROUND:
+                if task.key is not None and self._latest.get(task.key) is task:
+                    del self._latest[task.key]
+                self._drop(task)
+                return True
+        return False
+
+    def _next_task(self):
+        """取出下一个可以运行的任务，没有时等待（返回 None 表示执行器已关闭）"""
+        with self._condition:
+            while True:
+                while self._heap:
+                    _, _, task = self._heap[0]
+                    if task not in self._pending:
+                        heapq.heappop(self._heap)
+                        continue  # 已被取代或淘汰
+                    if task.priority >= PRIORITY_BACKGROUND and self._background_running >= self.max_background:
+                        # 后台任务优先级最低，排在最前面说明队列里只剩后台任务，等有后台任务结束
+                        break
+                    heapq.heappop(self._heap)
+                    if task.key is not None and task.key in self._running:
+                        # 同 key 的任务还在运行，等它结束后再排队
+                        del self._pending[task]
+                        if self._latest.get(task.key) is task:
+                            del self._latest[task.key]
+                        self._parked[task.key] = task
+                        continue
+                    del self._pending[task]
+                    if task.key is not None:
+                        if self._latest.get(task.key) is task:
+                            del self._latest[task.key]
+                        self._running[task.key] = task
+                    if task.priority >= PRIORITY_BACKGROUND:
+                        self._background_running += 1
+                    self._running_priorities.append(task.priority)
+                    return task
+                if self._shutdown:
+                    return None
+                self._condition.wait()
+
+    def _finish(self, task):
+        with self._condition:
+            self._running_priorities.remove(task.priority)
+            if task.priority >= PRIORITY_BACKGROUND:
+                self._background_running -= 1
+                self._condition.notify()
+            if task.key is not None and self._running.get(task.key) is task:
+                del self._running[task.key]
+                parked = self._parked.pop(task.key, None)
+                if parked is not None and not parked.is_cancelled():
+                    self._push(parked)
+                    self._condition.notify()
+
+    def _worker(self):
+        while True:
+            task = self._next_task()
+            if task is None:
+                return
+
+            _local.task = task
+            try:
+                result = task.func(*task.args, **task.kwargs)
+            except Exception as e:
+                print(f"后台任务出错: {getattr(task.func, '__name__', task.func)}: {e}")
+                if task.on_error:
+                    self._run_callback(task.on_error, e)
+            else:
+                if task.on_done and not task.is_cancelled():
+                    self._run_callback(task.on_done, result)
+            finally:
+                _local.task = None
+                self._finish(task)
+
+    def _run_callback(self, callback, value):
+        try:
+            callback(value)
+        except Exception as e:
+            print(f"任务回调出错: {e}")
+
+    def pending_count(self):
+        with self._condition:
+            return len(self._pending)
+
+    def is_busy(self, priority=PRIORITY_CHAT):
+        """是否有优先级不低于 priority 的任务在排队或运行（例如有对话在等待回复时推迟后台任务）"""
+        with self._condition:
+            return (any(running <= priority for running in self._running_priorities)
+                    or any(task.priority <= priority for task in self._pending)
+                    or any(task.priority <= priority for task in self._parked.values()))
+
+    def shutdown(self):
+        """停止接收新任务，丢弃排队中的任务，工作线程在当前任务结束后退出"""
+        with self._condition:
+            self._shutdown = True
+            for task in list(self._pending):
+                self._drop(task)
+            self._parked.clear()
+            for task in self._running.values():
+                task.cancel()
+            self._condition.notify_all()
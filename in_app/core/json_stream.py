@@ -0,0 +1,147 @@
+import json
+
+
+def iter_cursor_dicts(cursor, keys=None, chunk_size=1000):
+    """分批读取查询结果并逐条转换为字典，避免一次性 fetchall
+
+    keys 为输出字段名，默认使用查询结果的列名。
+    """
+    if keys is None:
+        keys = [column[0] for column in cursor.description]
+
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        for row in rows:
+            yield dict(zip(keys, row))
+
+
+def dump_array(items, f, indent=2):
+    """把可迭代对象逐条写成JSON数组，返回写入的条数
+
+    indent 不为 None 时输出与 json.dump(list, indent=indent) 完全相同的格式；
+    indent=None 时输出不带空白的紧凑格式。
+    """
+    count = 0
+
+    if indent is None:
+        f.write('[')
+        for item in items:
+            if count:
+                f.write(',')
+            f.write(json.dumps(item, ensure_ascii=False, separators=(',', ':')))
+            count += 1
+        f.write(']')
+        return count
+
+    padding = ' ' * indent
+    for item in items:
+        f.write(',\n' if count else '[\n')
+        text = json.dumps(item, ensure_ascii=False, indent=indent)
+        f.write(padding + text.replace('\n', '\n' + padding))
+        count += 1
+
+    f.write('\n]' if count else '[]')
+    return count
+
+
+_WHITESPACE = ' \t\n\r'
+_ITEM_END = _WHITESPACE + ',]'
+
+
+def iter_array(f, chunk_size=65536):
+    """增量解析文件中的JSON数组，逐个产出元素
+
+    同一遍扫描中完成格式校验：顶层不是数组或内容损坏时抛出 ValueError。
+    缓冲区只保留当前元素和一个读取块，内存占用与文件大小无关。
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            fill()
+
+    fill()
+    if buf.startswith('\ufeff'):
+        pos = 1
+
+    skip_whitespace()
+    if pos >= len(buf) or buf[pos] != '[':
+        raise ValueError("文件格式错误：应该是JSON数组")
+    pos += 1
+
+    skip_whitespace()
+    if pos < len(buf) and buf[pos] == ']':
+        pos += 1
+    else:
+        while True:
+            skip_whitespace()
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise ValueError(f"JSON格式错误: {e}")
+                fill()
+                continue
+
+            # 元素后面不是分隔符时可能是被截断了（例如数字 1.5e），读入更多内容后重新解析
+            if not eof and (end == len(buf) or buf[end] not in _ITEM_END):
+                fill()
+                continue
+
+            yield item
+            pos = end
+
+            skip_whitespace()
+            if pos >= len(buf):
+                raise ValueError("JSON格式错误: 数组没有结束")
+            if buf[pos] == ',':
+                pos += 1
+            elif buf[pos] == ']':
+                pos += 1
+                break
+            else:
+                raise ValueError(f"JSON格式错误: 数组元素之间缺少逗号（位置 {pos}）")
+
+    skip_whitespace()
+    if pos < len(buf):
+        raise ValueError("JSON格式错误: 数组之后还有多余内容")
+
+
+def dump_lines(items, f):
+    """把可迭代对象写成JSON Lines（每行一个JSON），返回写入的条数"""
+    count = 0
+    for item in items:
+        f.write(json.dumps(item, ensure_ascii=False, separators=(',', ':')))
+        f.write('\n')
+        count += 1
+    return count
+
+
+def iter_lines(f):
+    """逐行解析二进制方式打开的JSON Lines文件，跳过空行，格式错误时抛出 ValueError"""
+    for line_number, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line.decode('utf-8-sig'))
+        except ValueError as e:
+            raise ValueError(f"JSON格式错误（第 {line_number} 行）: {e}")
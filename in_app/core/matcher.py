@@ -0,0 +1,93 @@
+from collections import deque
+
+
+class KeywordMatcher:
+    """基于Aho-Corasick自动机的多关键词匹配器
+
+    用rules.json中的全部关键词构建一次自动机，之后每句话只需从头到尾扫描一遍，
+    就能找出所有关键词第一次出现的位置。
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        # 每个状态的转移表、失败指针、以及在该状态结束的关键词
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        self._has_empty_keyword = False
+
+        for keywords in rules.values():
+            for keyword in keywords:
+                self._add_keyword(keyword)
+        self._build_fail_links()
+
+    def _add_keyword(self, keyword):
+        if not keyword:
+            # 空字符串在任何句子的开头都能匹配，与 `'' in text` 的行为一致
+            self._has_empty_keyword = True
+            return
+
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][char] = next_state
+            state = next_state
+
+        if keyword not in self._output[state]:
+            self._output[state].append(keyword)
+
+    def _build_fail_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                # 合并失败状态的输出，这样扫描时不需要再沿失败链查找
+                self._output[next_state].extend(self._output[self._fail[next_state]])
+
+    def find_first_positions(self, text):
+        """一次扫描文本，返回 {关键词: 第一次出现的起始位置}"""
+        positions = {}
+        if self._has_empty_keyword:
+            positions[''] = 0
+
+        state = 0
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for keyword in output[state]:
+                if keyword not in positions:
+                    positions[keyword] = index - len(keyword) + 1
+        return positions
+
+    def match(self, text):
+        """按规则顺序返回每个类别中第一个命中的关键词
+
+        返回 [(category, keyword, index), ...]，每个类别最多一项，
+        与逐个关键词 `keyword in text` 再 `text.index(keyword)` 的结果完全一致。
+        """
+        positions = self.find_first_positions(text)
+        if not positions:
+            return []
+
+        matches = []
+        for category, keywords in self.rules.items():
+            for keyword in keywords:
+                index = positions.get(keyword)
+                if index is not None:
+                    matches.append((category, keyword, index))
+                    break  # 一个类别只取第一个命中的关键词
+        return matches
@@ -0,0 +1,115 @@
+import math
+import re
+from collections import Counter
+
+# 连续的英文/数字作为一个词，连续的中文按字切分
+_TOKEN_PATTERN = re.compile(r'[A-Za-z0-9_]+|[\u4e00-\u9fff\u3400-\u4dbf]+')
+_CJK_PATTERN = re.compile(r'[\u4e00-\u9fff\u3400-\u4dbf]')
+
+
+def tokenize(text):
+    """把文本切成检索用的词：英文单词小写，中文取单字和相邻两字"""
+    tokens = []
+    for run in _TOKEN_PATTERN.findall(text or ''):
+        if _CJK_PATTERN.match(run):
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run.lower())
+    return tokens
+
+
+class PreferenceRetriever:
+    """按与当前输入的相关度（BM25）挑选偏好，在字数预算内组装提示词
+
+    用户名和AI名字这类身份信息总是保留；其余偏好按相关度排序，
+    相关度相同时保持表中原有顺序，直到用完字数预算。
+    """
+
+    PINNED_KEYS = ('user_name', 'ai_name')
+
+    def __init__(self, rows, k1=1.2, b=0.75):
+        # rows: [(category, key_text, value_text), ...]
+        self.rows = rows
+        self.k1 = k1
+        self.b = b
+
+        self.doc_terms = [Counter(tokenize(f"{key} {value or ''}")) for _, key, value in rows]
+        self.doc_lengths = [sum(terms.values()) for terms in self.doc_terms]
+        self.avg_length = (sum(self.doc_lengths) / len(rows)) if rows else 0
+
+        document_frequency = Counter()
+        for terms in self.doc_terms:
+            document_frequency.update(terms.keys())
+        total = len(rows)
+        self.idf = {
+            term: math.log(1 + (total - freq + 0.5) / (freq + 0.5))
+            for term, freq in document_frequency.items()
+        }
+
+    def is_pinned(self, row):
+        category, key, _ = row
+        return category == 'fact' and key in self.PINNED_KEYS
+
+    def score(self, index, query_terms):
+        terms = self.doc_terms[index]
+        length_norm = 1 - self.b + self.b * self.doc_lengths[index] / (self.avg_length or 1)
+        total = 0.0
+        for term in query_terms:
+            freq = terms.get(term)
+            if freq:
+                total += self.idf[term] * freq * (self.k1 + 1) / (freq + self.k1 * length_norm)
+        return total
+
+    def select(self, query, render, max_chars):
+        """返回在 max_chars 字数内要放进提示词的偏好行（已渲染的文本）"""
+        query_terms = set(tokenize(query))
+
+        pinned = []
+        ranked = []
+        for index, row in enumerate(self.rows):
+            if self.is_pinned(row):
+                pinned.append(index)
+            else:
+                ranked.append((-self.score(index, query_terms), index))
+        ranked.sort()
+
+        lines = []
+        used = 0
+        for index in pinned:
+            line = render(*self.rows[index])
+            lines.append(line)
+            used += len(line) + 1
+
+        for _, index in ranked:
+            line = render(*self.rows[index])
+            if used + len(line) + 1 > max_chars:
+                continue
+            lines.append(line)
+            used += len(line) + 1
+
+        return lines
+
+
+def segment_text(text):
+    """把文本切分成以空格分隔的词，写入全文索引（FTS5的unicode61分词器按空格切分）"""
+    return ' '.join(tokenize(text))
+
+
+def build_match_query(text):
+    """根据用户输入构建FTS5的MATCH表达式，任意一个词命中即可，由bm25排序
+
+    中文只用相邻两字（单字太常见，几乎每条记录都会命中），只有一个字时才用单字。
+    """
+    terms = []
+    for run in _TOKEN_PATTERN.findall(text or ''):
+        if _CJK_PATTERN.match(run):
+            if len(run) == 1:
+                terms.append(run)
+            else:
+                terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            terms.append(run.lower())
+
+    unique_terms = list(dict.fromkeys(terms))
+    return ' OR '.join('"' + term.replace('"', '""') + '"' for term in unique_terms)
@@ -0,0 +1,265 @@
+import os
+import threading
+
+try:
+    import numpy as np
+except ImportError:  # numpy是可选依赖，没有安装时语义记忆功能关闭
+    np = None
+
+
+def is_available():
+    """是否可以使用语义记忆（需要numpy）"""
+    return np is not None
+
+
+def normalize(vector):
+    """转换为float32并归一化，之后点积就是余弦相似度"""
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm else array
+
+
+def vector_to_blob(vector):
+    """把向量归一化后按float16保存为字节串（每一维2字节）"""
+    return normalize(vector).astype(np.float16).tobytes()
+
+
+def blob_to_vector(blob):
+    """从数据库中的字节串还原float16向量"""
+    return np.frombuffer(blob, dtype=np.float16)
+
+
+def spherical_kmeans(data, nlist, iterations=8, seed=0):
+    """对归一化向量做球面k-means（按余弦相似度聚类），返回归一化的聚类中心"""
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        labels = np.argmax(data @ centroids.T, axis=1)
+        # 用one-hot矩阵乘法求各簇向量之和，比逐行累加快得多
+        onehot = np.zeros((len(data), nlist), dtype=np.float32)
+        onehot[np.arange(len(data)), labels] = 1
+        sums = onehot.T @ data
+        norms = np.linalg.norm(sums, axis=1)
+        # 空簇保留原来的中心
+        filled = norms > 0
+        centroids[filled] = sums[filled] / norms[filled, None]
+    return centroids
+
+
+class SemanticIndex:
+    """保存在内存中的对话向量矩阵，用NumPy向量化计算余弦相似度并取top-k
+
+    矩阵以float16存放以节省内存；检索时分块转换为float32再做矩阵乘法，
+    这样既能用上BLAS，又不需要整份float32副本。
+
+    向量数达到 min_train_size 后可以训练IVF（倒排文件）近似索引：
+    用k-means把向量分成约 sqrt(n) 个簇，检索时只计算与查询最接近的 nprobe 个簇，
+    新向量直接归入最近的簇，数量增长到训练时的 retrain_factor 倍后重新训练。
+    """
+
+    def __init__(self, dim=None, block_size=1024, min_train_size=20000, nprobe=16,
+                 max_lists=1024, retrain_factor=4):
+        self.dim = dim
+        self.block_size = block_size
+        self.min_train_size = min_train_size
+        self.nprobe = nprobe
+        self.max_lists = max_lists
+        self.retrain_factor = retrain_factor
+
+        self._ids = np.empty(0, dtype=np.int64)
+        self._matrix = np.empty((0, dim or 0), dtype=np.float16)
+        self._size = 0
+        self._lock = threading.Lock()
+
+        # IVF状态：聚类中心、每个向量所属的簇、训练时的向量数
+        self.centroids = None
+        self._assign = np.empty(0, dtype=np.int32)
+        self.trained_size = 0
+        self.unsaved_count = 0  # 上次保存索引文件后新增的向量数
+
+    def __len__(self):
+        return self._size
+
+    def add(self, ids, vectors):
+        """追加向量（已归一化的float16），维度与索引不一致的向量会被忽略"""
+        rows = []
+        row_ids = []
+        for memory_id, vector in zip(ids, vectors):
+            vector = np.asarray(vector, dtype=np.float16)
+            if self.dim is None:
+                self.dim = len(vector)
+                self._matrix = np.empty((0, self.dim), dtype=np.float16)
+            if len(vector) != self.dim:
+                continue
+            rows.append(vector)
+            row_ids.append(memory_id)
+        if not rows:
+            return 0
+
+        block = np.stack(rows)
+        with self._lock:
+            needed = self._size + len(rows)
+            if needed > len(self._ids):
+                # 容量按倍数增长，避免每次追加都复制整个矩阵
+                capacity = max(needed, len(self._ids) * 2, 64)
+                matrix = np.empty((capacity, self.dim), dtype=np.float16)
+                matrix[:self._size] = self._matrix[:self._size]
+                ids = np.empty(capacity, dtype=np.int64)
+                ids[:self._size] = self._ids[:self._size]
+                assign = np.empty(capacity, dtype=np.int32)
+                assign[:self._size] = self._assign[:self._size]
+                self._matrix = matrix
+                self._ids = ids
+                self._assign = assign
+            self._matrix[self._size:needed] = block
+            self._ids[self._size:needed] = row_ids
+            if self.centroids is not None:
+                # 已训练时，新向量直接归入最近的簇
+                self._assign[self._size:needed] = self._nearest_lists(block, self.centroids)
+                self.unsaved_count += len(rows)
+            self._size = needed
+        return len(rows)
+
+    def _nearest_lists(self, vectors, centroids):
+        """分块计算每个向量最接近的聚类中心"""
+        labels = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), self.block_size):
+            end = min(start + self.block_size, len(vectors))
+            labels[start:end] = np.argmax(vectors[start:end].astype(np.float32) @ centroids.T, axis=1)
+        return labels
+
+    def search(self, query_vector, k=3, exact=False):
+        """返回与查询向量最相似的 k 条 [(memory_id, score), ...]，按相似度从高到低
+
+        已训练IVF索引时只检索最接近的 nprobe 个簇；exact=True 时总是逐条比较全部向量。
+        """
+        query = normalize(query_vector)
+        with self._lock:
+            size = self._size
+            matrix = self._matrix
+            ids = self._ids
+            assign = self._assign
+            centroids = self.centroids
+        if not size or len(query) != self.dim or k <= 0:
+            return []
+
+        if centroids is not None and not exact:
+            nprobe = min(self.nprobe, len(centroids))
+            probe = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+            rows = np.flatnonzero(np.isin(assign[:size], probe))
+            if len(rows) < k:
+                rows = np.arange(size)
+        else:
+            rows = None
+
+        if rows is None:
+            scores = np.empty(size, dtype=np.float32)
+            for start in range(0, size, self.block_size):
+                end = min(start + self.block_size, size)
+                scores[start:end] = matrix[start:end].astype(np.float32) @ query
+            row_ids = ids[:size]
+        else:
+            scores = matrix[rows].astype(np.float32) @ query
+            row_ids = ids[rows]
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(row_ids[i]), float(scores[i])) for i in top]
+
+    def needs_training(self):
+        """向量数达到阈值且还没有训练，或比上次训练时增长了很多"""
+        if self._size < self.min_train_size:
+            return False
+        return self.centroids is None or self._size >= self.trained_size * self.retrain_factor
+
+    def train(self, iterations=8, seed=0):
+        """训练IVF索引：在抽样向量上做k-means，再把全部向量归入最近的簇"""
+        with self._lock:
+            size = self._size
+            matrix = self._matrix
+        if size < 2:
+            return False
+
+        nlist = max(1, min(self.max_lists, int(size ** 0.5)))
+        rng = np.random.default_rng(seed)
+        # 每个簇约32个样本就足够估计中心，不需要用全部向量
+        sample_size = min(size, nlist * 32)
+        sample = matrix[np.sort(rng.choice(size, sample_size, replace=False))].astype(np.float32)
+        centroids = spherical_kmeans(sample, nlist, iterations=iterations, seed=seed)
+        assign = self._nearest_lists(matrix[:size], centroids)
+
+        with self._lock:
+            # 训练期间新增的向量也要归入簇
+            if self._size > size:
+                extra = self._nearest_lists(self._matrix[size:self._size], centroids)
+                assign = np.concatenate([assign, extra])
+            full = np.empty(len(self._ids), dtype=np.int32)
+            full[:self._size] = assign
+            self._assign = full
+            self.centroids = centroids
+            self.trained_size = self._size
+            self.unsaved_count = self._size
+        print(f"训练语义索引完成: {size} 条向量, {nlist} 个簇")  # 调试信息
+        return True
+
+    def save(self, path, model):
+        """把IVF索引（聚类中心和每条向量所属的簇）保存到文件，向量本身仍在数据库中"""
+        with self._lock:
+            if self.centroids is None:
+                return False
+            data = {
+                'model': np.array(model),
+                'centroids': self.centroids,
+                'ids': self._ids[:self._size].copy(),
+                'assign': self._assign[:self._size].copy(),
+                'trained_size': np.array(self.trained_size),
+            }
+            saved = self._size
+
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez(f, **data)
+        os.replace(temp_path, path)
+        with self._lock:
+            self.unsaved_count = max(0, self.unsaved_count - saved)
+        return True
+
+    def load(self, path, model):
+        """读取保存的IVF索引；模型或维度不一致时忽略，文件之后新增的向量重新归簇"""
+        if not os.path.exists(path):
+            return False
+        try:
+            with np.load(path) as data:
+                if str(data['model']) != model:
+                    return False
+                centroids = data['centroids']
+                saved_ids = data['ids']
+                saved_assign = data['assign']
+                trained_size = int(data['trained_size'])
+        except Exception as e:
+            print(f"读取语义索引文件失败: {e}")  # 调试信息
+            return False
+        if centroids.ndim != 2 or centroids.shape[1] != self.dim:
+            return False
+
+        with self._lock:
+            size = self._size
+            ids = self._ids[:size]
+            assign = np.empty(len(self._ids), dtype=np.int32)
+
+            # 按ID找到每条向量保存时所属的簇
+            order = np.argsort(saved_ids)
+            sorted_ids = saved_ids[order]
+            positions = np.minimum(np.searchsorted(sorted_ids, ids), max(len(sorted_ids) - 1, 0))
+            found = (sorted_ids[positions] == ids) if len(sorted_ids) else np.zeros(size, dtype=bool)
+            assign[:size][found] = saved_assign[order][positions[found]]
+            missing = np.flatnonzero(~found)
+            if len(missing):
+                assign[missing] = self._nearest_lists(self._matrix[missing], centroids)
+
+            self._assign = assign
+            self.centroids = centroids
+            self.trained_size = trained_size
+            self.unsaved_count = len(missing)
+        return True
@@ -0,0 +1,111 @@
+from collections import deque
+from datetime import datetime
+from itertools import islice
+
+
+class Message:
+    """聊天区域中的一条消息"""
+
+    __slots__ = ('id', 'speaker', 'text', 'time')
+
+    def __init__(self, message_id, speaker, text, time):
+        self.id = message_id
+        self.speaker = speaker
+        self.text = text
+        self.time = time
+
+    def render(self):
+        return f"[{self.time}] {self.speaker}: {self.text}\n\n"
+
+
+class Transcript:
+    """聊天记录模型：用环形缓冲区保存最近 max_messages 条消息，界面只显示这些消息
+
+    每条消息有一个ID，可以之后修改（例如把"正在思考"的占位消息换成AI回复、流式追加文本），
+    不需要在整段文本上查找替换。渲染时缓存除最后一条以外的文本，
+    流式回复只改动最后一条消息，所以每次渲染只需拼接一次。
+    """
+
+    def __init__(self, max_messages=200, header=''):
+        self.max_messages = max_messages
+        self.header = header
+        self._messages = deque(maxlen=max_messages)
+        self._index = {}  # 消息ID -> Message
+        self._next_id = 1
+        self._prefix = None  # 缓存：header + 除最后一条以外所有消息的文本
+
+    def __len__(self):
+        return len(self._messages)
+
+    def append(self, speaker, text, time=None):
+        """追加一条消息，返回消息ID；超过 max_messages 时最早的消息被移出"""
+        if len(self._messages) == self.max_messages:
+            evicted = self._messages[0]
+            self._index.pop(evicted.id, None)
+            self._prefix = None
+        elif self._prefix is not None and self._messages:
+            # 原来的最后一条变成了前缀的一部分
+            self._prefix += self._messages[-1].render()
+
+        message = Message(self._next_id, speaker, text, time or datetime.now().strftime("%H:%M"))
+        self._next_id += 1
+        self._messages.append(message)
+        self._index[message.id] = message
+        return message.id
+
+    def get(self, message_id):
+        return self._index.get(message_id)
+
+    def update(self, message_id, text=None, speaker=None, time=None):
+        """修改一条消息的内容，消息已被移出时返回 False"""
+        message = self._index.get(message_id)
+        if message is None:
+            return False
+        if text is not None:
+            message.text = text
+        if speaker is not None:
+            message.speaker = speaker
+        if time is not None:
+            message.time = time
+        self._invalidate(message)
+        return True
+
+    def append_text(self, message_id, chunk):
+        """在一条消息末尾追加文本（流式回复）"""
+        message = self._index.get(message_id)
+        if message is None:
+            return False
+        message.text += chunk
+        self._invalidate(message)
+        return True
+
+    def remove(self, message_id):
+        """删除一条消息"""
+        message = self._index.pop(message_id, None)
+        if message is None:
+            return False
+        self._messages.remove(message)
+        self._prefix = None
+        return True
+
+    def clear(self, header=''):
+        """清空所有消息"""
+        self.header = header
+        self._messages.clear()
+        self._index.clear()
+        self._prefix = None
+
+    def _invalidate(self, message):
+        # 只有最后一条消息不在缓存的前缀里
+        if not self._messages or self._messages[-1] is not message:
+            self._prefix = None
+
+    def render(self):
+        """返回显示在聊天区域中的完整文本"""
+        if not self._messages:
+            return self.header
+        if self._prefix is None:
+            parts = [self.header]
+            parts.extend(message.render() for message in islice(self._messages, len(self._messages) - 1))
+            self._prefix = ''.join(parts)
+        return self._prefix + self._messages[-1].render()
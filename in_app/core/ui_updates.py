@@ -0,0 +1,94 @@
+import threading
+import time
+
+
+class UIUpdateCoalescer:
+    """把后台线程产生的界面更新合并起来，按固定帧率在主线程中统一执行
+
+    - post(func, *args) 可以在任意线程调用，回调会在下一帧按提交顺序在主线程执行；
+      带 key 的回调在同一帧内只保留最后一次（例如导入进度只显示最新的）
+    - mark_dirty() 表示界面需要重绘，一帧最多调用一次 on_flush（例如重新渲染聊天区域）
+    - 不论事件多频繁，主线程每秒最多处理 1 / interval 次
+    """
+
+    def __init__(self, loop, on_flush=None, interval=0.05):
+        self.loop = loop
+        self.on_flush = on_flush
+        self.interval = interval
+
+        self._lock = threading.Lock()
+        self._pending = []  # [key, func, args]
+        self._keyed = {}    # key -> 本帧中该 key 的回调
+        self._dirty = False
+        self._scheduled = False
+        self._in_flush = False
+        self._last_flush = 0.0
+
+        # 统计信息，便于观察合并效果
+        self.posted_count = 0
+        self.flush_count = 0
+        self.render_count = 0
+
+    def post(self, func, *args, key=None):
+        """提交一个在主线程执行的回调（线程安全）"""
+        with self._lock:
+            self.posted_count += 1
+            entry = self._keyed.get(key) if key is not None else None
+            if entry is not None:
+                entry[1] = func
+                entry[2] = args
+            else:
+                entry = [key, func, args]
+                self._pending.append(entry)
+                if key is not None:
+                    self._keyed[key] = entry
+            self._request_flush()
+
+    def mark_dirty(self):
+        """标记界面需要重绘（线程安全）"""
+        with self._lock:
+            self._dirty = True
+            # 在本帧的回调中标记时，本帧结束时就会重绘，不需要再安排下一帧
+            if not self._in_flush:
+                self._request_flush()
+
+    def _request_flush(self):
+        # 调用方持有锁
+        if not self._scheduled:
+            self._scheduled = True
+            self.loop.call_soon_threadsafe(self._schedule_flush)
+
+    def _schedule_flush(self):
+        # 在主线程中运行：距离上一帧不足 interval 时等到下一帧
+        delay = max(0.0, self._last_flush + self.interval - time.monotonic())
+        self.loop.call_later(delay, self.flush)
+
+    def flush(self):
+        """执行积累的回调并重绘（在主线程中调用）"""
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+            self._keyed = {}
+            self._scheduled = False
+            self._in_flush = True
+        self._last_flush = time.monotonic()
+
+        try:
+            for _, func, args in pending:
+                try:
+                    func(*args)
+                except Exception as e:
+                    print(f"界面更新出错: {e}")
+        finally:
+            with self._lock:
+                self._in_flush = False
+                dirty = self._dirty
+                self._dirty = False
+
+        self.flush_count += 1
+        if dirty and self.on_flush:
+            self.render_count += 1
+            try:
+                self.on_flush()
+            except Exception as e:
+                print(f"界面重绘出错: {e}")
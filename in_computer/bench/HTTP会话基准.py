@@ -0,0 +1,89 @@
+"""
+测量每次请求新建连接（requests.post）与 AIClient 长连接会话的单次请求开销。
+使用本地模拟的Ollama服务（立即返回固定回复），因此测到的几乎全是连接与请求本身的开销。
+基准请求带 Connection: close，服务端统计新建的TCP连接数，确认它每次都是冷连接、长连接确实被复用。
+"""
+import io
+import os
+import sys
+import json
+import time
+import threading
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'in_app'))
+
+from core.ai_client import AIClient
+
+REQUESTS = 300
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    """模拟 /api/generate 的非流式响应，支持HTTP/1.1长连接"""
+    protocol_version = 'HTTP/1.1'
+    # 与Ollama（Go默认开启TCP_NODELAY）一致，避免Nagle算法与延迟确认叠加造成的40ms等待
+    disable_nagle_algorithm = True
+    # 服务端接受的TCP连接数
+    connections = 0
+
+    def setup(self):
+        StubOllamaHandler.connections += 1
+        super().setup()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        body = json.dumps({"model": "stub", "response": "你好", "done": True}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def measure(label, send):
+    send()  # 预热
+    connections = StubOllamaHandler.connections
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        send()
+    elapsed = time.perf_counter() - start
+    opened = StubOllamaHandler.connections - connections
+    print(f"{label}: {elapsed * 1000 / REQUESTS:.2f} ms/请求，新建连接 {opened} 次")
+
+
+def main():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubOllamaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    url = f"{base}/api/generate"
+    payload = {"model": "stub", "prompt": "你好", "stream": False}
+
+    client = AIClient()
+    client.endpoint_urls = {name: f"{base}/api/{name}" for name in client.endpoint_urls}
+    client.endpoint_urls['generate'] = url
+
+    def chat():
+        # chat 会打印调试信息，这里屏蔽掉避免影响计时
+        with contextlib.redirect_stdout(io.StringIO()):
+            client.chat("你好", [], "")
+
+    # requests.post 每次创建新的 Session；再要求服务端关闭连接，保证每个请求都重新建立TCP连接
+    cold_headers = {'Connection': 'close'}
+    measure("requests.post（每次新建连接）",
+            lambda: requests.post(url, json=payload, headers=cold_headers, timeout=10))
+    measure("AIClient.session（长连接）", lambda: client.session.post(url, json=payload, timeout=(5, 10)))
+    measure("AIClient.chat（完整流程）", chat)
+
+    client.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
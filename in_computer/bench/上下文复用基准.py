@@ -0,0 +1,80 @@
+"""
+对比每轮发送完整提示词与接着上一轮 context（复用KV缓存）两种方式下，
+Ollama 处理提示词的耗时（prompt_eval_duration）。需要本机已启动 Ollama 并拉取了模型。
+偏好和 app 中一样通过 get_relevant_preferences 按每轮输入挑选（偏好超过字数预算，每轮挑出的文本不同）。
+
+用法: python 上下文复用基准.py [模型名] [轮数]
+"""
+import io
+import os
+import sys
+import contextlib
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'in_app'))
+
+from core.ai_client import AIClient
+from core.database import DatabaseManager
+
+PREFERENCES = [
+    ('fact', 'user_name', '小林', None),
+    ('like', '数学', '喜欢', None),
+    ('like', '跑步', '喜欢', None),
+    ('fact', '计算机', '专业是', None),
+    ('hobby', '熬夜', '经常', None),
+] + [('like', f'{subject}{i}', '喜欢', None)
+     for i in range(12) for subject in ('线性代数', '概率论', '夜跑', '时间管理')]
+
+QUESTIONS = [
+    "今天有点累，学不进去",
+    "线性代数的特征值怎么理解",
+    "能给我举个例子吗",
+    "那特征向量呢",
+    "晚上想去跑步，你觉得呢",
+    "跑完步适合继续学习吗",
+    "帮我安排一下今晚的时间",
+    "谢谢你，晚安",
+]
+
+
+def run(model, turns, reuse_context):
+    client = AIClient(model=model)
+    client.reuse_context = reuse_context
+    history = []
+    data_dir = tempfile.mkdtemp()
+    try:
+        # chat 和数据库会打印调试信息，这里屏蔽掉
+        with contextlib.redirect_stdout(io.StringIO()):
+            db = DatabaseManager(data_dir)
+            db.insert_preferences(PREFERENCES)
+            for i in range(turns):
+                question = QUESTIONS[i % len(QUESTIONS)]
+                user_memory = db.get_relevant_preferences(question)
+                reply = "".join(client.chat_stream(question, history, user_memory,
+                                                   memory_version=db.get_preferences_version()))
+                history.append({'user': question, 'ai': reply})
+            db.close()
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    client.close()
+    return client.get_prompt_eval_stats()
+
+
+def main():
+    model = sys.argv[1] if len(sys.argv) > 1 else "qwen2.5:0.5b"
+    turns = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    for label, reuse_context in [("每轮完整提示词", False), ("复用上一轮context", True)]:
+        stats = run(model, turns, reuse_context)
+        if not stats:
+            print(f"{label}: 没有拿到耗时统计（Ollama是否已启动？）")
+            continue
+        for kind, item in stats.items():
+            name = "首轮/重新开始" if kind == 'full' else "接着上一轮"
+            print(f"{label} - {name}: {item['turns']} 轮, "
+                  f"平均 {item['avg_tokens']:.0f} tokens, {item['avg_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
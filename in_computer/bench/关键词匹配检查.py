@@ -0,0 +1,96 @@
+"""
+检查 KeywordMatcher 的结果与原来逐个关键词 `keyword in text` 的嵌套循环完全一致。
+随机生成规则和句子（字符集很小，关键词之间大量重叠、互为前后缀，也包含空关键词和重复关键词），
+再用默认规则匹配一些真实句子，逐条比较两种方法的结果。有不一致时退出码为1。
+
+用法: python 关键词匹配检查.py [句子数]
+"""
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'in_app'))
+
+from core.matcher import KeywordMatcher
+
+ALPHABET = "我是喜欢爱不叫"
+
+DEFAULT_RULES = {
+    "fact": ["我叫", "我是", "我的名字是", "你可以叫我", "我学", "专业是"],
+    "like": ["喜欢", "爱", "讨厌", "不喜欢", "受不了", "挺喜欢"],
+    "hobby": ["经常", "习惯", "总是", "每次", "一般会"]
+}
+
+SENTENCES = [
+    "我叫小林，我的专业是计算机",
+    "我不喜欢下雨天，但是挺喜欢看书",
+    "我经常熬夜，总是早上起不来",
+    "你可以叫我阿林，我学数学的",
+    "每次考试前我都受不了",
+    "今天天气不错",
+]
+
+
+def nested_loop_match(rules, text):
+    """原来的做法：每个类别按顺序取第一个出现在句子中的关键词"""
+    matches = []
+    for category, keywords in rules.items():
+        for keyword in keywords:
+            if keyword in text:
+                matches.append((category, keyword, text.index(keyword)))
+                break
+    return matches
+
+
+def random_rules(rng):
+    rules = {}
+    for i in range(rng.randint(1, 4)):
+        keywords = []
+        for _ in range(rng.randint(0, 6)):
+            length = rng.choice([0, 1, 1, 2, 2, 3, 4])
+            keywords.append(''.join(rng.choice(ALPHABET) for _ in range(length)))
+        if keywords and rng.random() < 0.2:
+            keywords.append(rng.choice(keywords))  # 重复的关键词
+        rules[f"category{i}"] = keywords
+    return rules
+
+
+def random_text(rng):
+    return ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 30)))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = random.Random(0)
+
+    mismatches = 0
+    checked = 0
+    rules = None
+    matcher = None
+    for i in range(count):
+        if i % 100 == 0:
+            rules = random_rules(rng)
+            matcher = KeywordMatcher(rules)
+        text = random_text(rng)
+        expected = nested_loop_match(rules, text)
+        actual = matcher.match(text)
+        checked += 1
+        if actual != expected:
+            mismatches += 1
+            if mismatches <= 10:
+                print(f"❌ 规则 {rules} 句子 {text!r}: 期望 {expected}, 实际 {actual}")
+
+    matcher = KeywordMatcher(DEFAULT_RULES)
+    for text in SENTENCES:
+        checked += 1
+        if matcher.match(text) != nested_loop_match(DEFAULT_RULES, text):
+            mismatches += 1
+            print(f"❌ 默认规则 句子 {text!r}")
+
+    print(f"比较 {checked} 条句子，不一致 {mismatches} 条")
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
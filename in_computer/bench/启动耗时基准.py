@@ -0,0 +1,52 @@
+"""
+测量应用启动关键路径上数据库部分的耗时：构造时立即建表（原来的做法）与延迟到第一次访问再建表。
+应用启动时会打印窗口显示耗时并与 Talk_in_App_v01.STARTUP_BUDGET_MS 比较，这里单独看数据库的贡献。
+
+用法: python 启动耗时基准.py [次数]
+"""
+import io
+import os
+import sys
+import contextlib
+import shutil
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'in_app'))
+
+from core.database import DatabaseManager
+
+
+def measure(data_dir, lazy, runs):
+    construct, first_query = [], []
+    for _ in range(runs):
+        # 初始化会打印调试信息，这里屏蔽掉
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            db = DatabaseManager(data_dir, lazy=lazy)
+            construct.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            db.get_upcoming_schedules()
+            first_query.append(time.perf_counter() - start)
+            db.close()
+    return sum(construct) * 1000 / runs, sum(first_query) * 1000 / runs
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    data_dir = tempfile.mkdtemp()
+    try:
+        # 先建好数据库文件，模拟非首次启动
+        with contextlib.redirect_stdout(io.StringIO()):
+            DatabaseManager(data_dir).close()
+
+        for label, lazy in [("构造时建表", False), ("延迟打开", True)]:
+            construct_ms, query_ms = measure(data_dir, lazy, runs)
+            print(f"{label}: 构造 {construct_ms:.2f} ms（在启动关键路径上）, 第一次查询 {query_ms:.2f} ms")
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
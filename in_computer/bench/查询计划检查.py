@@ -0,0 +1,76 @@
+"""
+检查 DatabaseManager.QUERY_SQL 中的查询都走索引：用 EXPLAIN QUERY PLAN 查看执行计划，
+出现全表扫描（SCAN 表名 且没有 USING INDEX）或为排序建立临时B树时视为失败。
+改动表结构或查询后运行一次，有失败时退出码为1。
+
+用法: python 查询计划检查.py
+"""
+import io
+import os
+import sys
+import contextlib
+import shutil
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'in_app'))
+
+from core.database import DatabaseManager
+
+# 各查询的示例参数
+QUERY_PARAMS = {
+    'upcoming_schedules': ('2026-01-01 08:00', '2026-01-02 08:00'),
+    'all_schedules': (),
+    'recent_memories': (10,),
+    'preferences_by_category': (),
+}
+
+
+def check_plan(plan):
+    """返回执行计划中的问题列表"""
+    problems = []
+    for detail in plan:
+        if detail.startswith('SCAN') and 'USING' not in detail:
+            problems.append(f"全表扫描: {detail}")
+        if 'USE TEMP B-TREE' in detail:
+            problems.append(f"临时排序: {detail}")
+    return problems
+
+
+def fill(db, rows=2000):
+    """写入一些数据，让查询计划接近真实使用时的情况"""
+    db.insert_preferences([(('fact', 'like', 'hobby')[i % 3], f'偏好{i}', '喜欢', None) for i in range(rows // 10)])
+    with db.connections.connection(db.db_path) as conn:
+        conn.executemany("INSERT INTO MEMORY (user_input, AI_output) VALUES (?, ?)",
+                         [(f'对话{i}', f'回复{i}') for i in range(rows)])
+        conn.executemany("INSERT INTO SCHEDULE (event_time, event_name) VALUES (?, ?)",
+                         [(datetime(2026, 1, 1 + i % 28, i % 24, 0).strftime(db.EVENT_TIME_FORMAT), f'行程{i}')
+                          for i in range(rows)])
+
+
+def main():
+    data_dir = tempfile.mkdtemp()
+    failed = False
+    try:
+        # 初始化会打印调试信息，这里屏蔽掉
+        with contextlib.redirect_stdout(io.StringIO()):
+            db = DatabaseManager(data_dir)
+            fill(db)
+
+        with db.connections.connection(db.db_path) as conn:
+            for name, sql in db.QUERY_SQL.items():
+                plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", QUERY_PARAMS[name])]
+                problems = check_plan(plan)
+                print(f"{'✅' if not problems else '❌'} {name}: {'; '.join(plan)}")
+                for problem in problems:
+                    print(f"   {problem}")
+                failed = failed or bool(problems)
+        db.close()
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
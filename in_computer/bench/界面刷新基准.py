@@ -0,0 +1,88 @@
+"""
+界面刷新压力测试：多个后台线程同时高频提交流式回复片段和导入进度，
+检查合并后主线程的重绘次数不超过帧率上限、所有片段按顺序完整地写入聊天记录。
+不需要 Toga 和 Ollama，用 asyncio 事件循环代替界面主线程。
+
+用法: python 界面刷新基准.py [线程数] [每个线程的片段数]
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'in_app'))
+
+from core.transcript import Transcript
+from core.ui_updates import UIUpdateCoalescer
+
+INTERVAL = 0.05
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    chunks = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+
+    loop = asyncio.new_event_loop()
+    transcript = Transcript(max_messages=200)
+    rendered = []
+
+    def render():
+        rendered.append(len(transcript.render()))
+
+    ui_updates = UIUpdateCoalescer(loop, on_flush=render, interval=INTERVAL)
+    message_ids = [transcript.append("AI伙伴", "") for _ in range(threads)]
+    progress_id = transcript.append("系统", "")
+    # 记录每个线程最后写入的片段序号，用于检查顺序
+    last_seen = [-1] * threads
+    out_of_order = []
+
+    def append_chunk(worker, seq):
+        if seq != last_seen[worker] + 1:
+            out_of_order.append((worker, seq))
+        last_seen[worker] = seq
+        transcript.append_text(message_ids[worker], f"{seq % 10}")
+        ui_updates.mark_dirty()
+
+    def show_progress(processed):
+        transcript.update(progress_id, f"导入中... 已处理 {processed} 条")
+        ui_updates.mark_dirty()
+
+    def worker(index):
+        for seq in range(chunks):
+            ui_updates.post(append_chunk, index, seq)
+            if seq % 10 == 0:
+                ui_updates.post(show_progress, seq, key='import_progress')
+            if seq % 100 == 0:
+                time.sleep(0.002)  # 模拟模型逐段生成
+
+    async def run():
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        start = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        while any(thread.is_alive() for thread in workers):
+            await asyncio.sleep(0.01)
+        # 等最后一帧处理完
+        while sum(last_seen) + threads < threads * chunks:
+            await asyncio.sleep(INTERVAL)
+        await asyncio.sleep(INTERVAL * 2)
+        return time.perf_counter() - start
+
+    elapsed = loop.run_until_complete(run())
+    loop.close()
+
+    total = threads * chunks
+    max_renders = elapsed / INTERVAL + 2
+    complete = all(len(transcript.get(message_id).text) == chunks for message_id in message_ids)
+
+    print(f"{threads} 个线程共提交 {ui_updates.posted_count} 次更新（{total} 个片段），用时 {elapsed:.2f} s")
+    print(f"主线程处理 {ui_updates.flush_count} 帧，重绘 {ui_updates.render_count} 次"
+          f"（{ui_updates.render_count / elapsed:.1f} 次/秒，上限 {1 / INTERVAL:.0f} 次/秒）")
+    print(f"最终进度: {transcript.get(progress_id).text}")
+    print(f"片段完整: {'是' if complete else '否'}, 顺序错误: {len(out_of_order)} 处")
+    print(f"重绘次数不超过帧率上限: {'是' if ui_updates.render_count <= max_renders else '否'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+对比语义记忆的精确检索（逐条比较全部向量）与IVF近似检索的延迟和召回率。
+向量是人工生成的聚类数据（模拟相近话题的对话），召回率 = 近似结果中属于精确top-k的比例。
+
+用法: python 语义索引基准.py [向量数] [维度]
+"""
+import io
+import os
+import sys
+import contextlib
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'in_app'))
+
+from core.semantic import SemanticIndex, normalize
+
+QUERIES = 100
+TOP_K = 10
+
+
+def make_vectors(count, dim, topics=2000, noise=0.6, seed=0):
+    """生成围绕若干“话题”中心分布的归一化向量"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((topics, dim)).astype(np.float32)
+    labels = rng.integers(0, topics, count)
+    vectors = centers[labels] + noise * rng.standard_normal((count, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float16)
+
+
+def timed_search(index, queries, exact):
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        results.append([memory_id for memory_id, _ in index.search(query, TOP_K, exact=exact)])
+    elapsed = time.perf_counter() - start
+    return results, elapsed * 1000 / len(queries)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    dim = int(sys.argv[2]) if len(sys.argv) > 2 else 768
+
+    vectors = make_vectors(count, dim)
+    rng = np.random.default_rng(1)
+    # 查询是随机选中的已有向量加上扰动，相当于换个说法问同一件事
+    picked = vectors[rng.choice(count, QUERIES, replace=False)].astype(np.float32)
+    queries = [normalize(q) for q in picked + 0.3 * rng.standard_normal(picked.shape).astype(np.float32) / dim ** 0.5]
+
+    index = SemanticIndex()
+    index.add(range(count), vectors)
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        index.train()
+    print(f"{count} 条 {dim} 维向量，训练IVF索引 ({len(index.centroids)} 个簇): {time.perf_counter() - start:.2f} s")
+
+    exact_results, exact_ms = timed_search(index, queries, exact=True)
+    print(f"精确检索: {exact_ms:.2f} ms/次")
+
+    for nprobe in (4, 8, 16, 32, 64):
+        index.nprobe = nprobe
+        approx_results, approx_ms = timed_search(index, queries, exact=False)
+        hits = sum(len(set(a) & set(e)) for a, e in zip(approx_results, exact_results))
+        recall = hits / (len(queries) * TOP_K)
+        print(f"IVF nprobe={nprobe:>2}: {approx_ms:.2f} ms/次, recall@{TOP_K} = {recall:.3f}")
+
+
+if __name__ == "__main__":
+    main()
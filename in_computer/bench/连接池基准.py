@@ -0,0 +1,61 @@
+"""
+对比每次调用都重新连接与长连接两种方式下，每秒可以完成多少轮对话的数据库操作。
+一轮 = 读取用户偏好 + 保存一条对话，与 app 中每次发送消息时的数据库访问一致。
+"""
+import io
+import os
+import sys
+import contextlib
+import time
+import sqlite3
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'in_app'))
+
+from core.database import DatabaseManager
+
+TURNS = 500
+
+
+def turn_connect_per_call(db):
+    """旧方式：每个操作单独打开、提交、关闭连接"""
+    conn = sqlite3.connect(db.db_path)
+    conn.execute("SELECT category, key_text, value_text FROM PREFERENCES").fetchall()
+    conn.close()
+
+    conn = sqlite3.connect(db.db_path)
+    conn.execute("INSERT INTO MEMORY (user_input, AI_output) VALUES (?, ?)", ("我喜欢数学", "好的"))
+    conn.commit()
+    conn.close()
+
+
+def turn_pooled(db):
+    """新方式：通过 DatabaseManager 的长连接"""
+    db.get_user_preferences()
+    db.save_conversation("我喜欢数学", "好的")
+
+
+def run(turn_func):
+    with tempfile.TemporaryDirectory() as data_dir:
+        # save_conversation 会打印调试信息，这里屏蔽掉避免影响计时
+        with contextlib.redirect_stdout(io.StringIO()):
+            db = DatabaseManager(data_dir)
+            for i in range(20):
+                db.insert_preference('like', f'科目{i}', '喜欢', None)
+
+            start = time.perf_counter()
+            for _ in range(TURNS):
+                turn_func(db)
+            elapsed = time.perf_counter() - start
+            db.close()
+    return elapsed
+
+
+def main():
+    for label, func in [("每次重新连接", turn_connect_per_call), ("长连接", turn_pooled)]:
+        elapsed = run(func)
+        print(f"{label}: {TURNS / elapsed:.1f} 轮/秒 ({elapsed * 1000 / TURNS:.2f} ms/轮)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,17 @@
+import os
+import sys
 import sqlite3
 import json
 
+# 与APP共用同一个关键词匹配器
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'in_app'))
+from core.matcher import KeywordMatcher
+
 # 1. 加载规则
 with open('rules.json', 'r', encoding='utf-8') as f:
     rules = json.load(f)
 
+matcher = KeywordMatcher(rules)
 print("规则加载成功！")
 
 
@@ -41,35 +48,32 @@ def main():
     new_preferences_count = 0
 
     for conv_id, user_input in all_conversations:
-        for category, keywords in rules.items():
-            for keyword in keywords:
-                if keyword in user_input:
-                    print(f"在对话ID {conv_id} 中发现关键词 '{keyword}', 类别: '{category}'")
-                    print(f"完整对话: {user_input}")
-
-                    try:
-                        keyword_index = user_input.index(keyword)
-                        content_after_keyword = user_input[keyword_index + len(keyword):].strip()
-                        extracted_content = content_after_keyword.split(' ')[0] if content_after_keyword else ""
-
-                        if extracted_content:
-                            if category == 'fact' and ('名字' in keyword or '叫我' in keyword):
-                                key_to_store = 'user_name'
-                                value_to_store = extracted_content
-                            else:
-                                key_to_store = extracted_content
-                                value_to_store = keyword
-
-                            # 使用专门的函数插入数据
-                            if insert_preference(category, key_to_store, value_to_store, conv_id):
-                                new_preferences_count += 1
-                                print(f"--> 已存储: {category} | {key_to_store} | {value_to_store}")
-                            else:
-                                print("--> 存储失败")
-
-                    except Exception as e:
-                        print(f"处理句子时出错: {user_input}, 错误: {e}")
-                    break
+        # 一次扫描找出每个类别中第一个命中的关键词
+        for category, keyword, keyword_index in matcher.match(user_input):
+            print(f"在对话ID {conv_id} 中发现关键词 '{keyword}', 类别: '{category}'")
+            print(f"完整对话: {user_input}")
+
+            try:
+                content_after_keyword = user_input[keyword_index + len(keyword):].strip()
+                extracted_content = content_after_keyword.split(' ')[0] if content_after_keyword else ""
+
+                if extracted_content:
+                    if category == 'fact' and ('名字' in keyword or '叫我' in keyword):
+                        key_to_store = 'user_name'
+                        value_to_store = extracted_content
+                    else:
+                        key_to_store = extracted_content
+                        value_to_store = keyword
+
+                    # 使用专门的函数插入数据
+                    if insert_preference(category, key_to_store, value_to_store, conv_id):
+                        new_preferences_count += 1
+                        print(f"--> 已存储: {category} | {key_to_store} | {value_to_store}")
+                    else:
+                        print("--> 存储失败")
+
+            except Exception as e:
+                print(f"处理句子时出错: {user_input}, 错误: {e}")
 
     print(f"挖掘完成！共新增了 {new_preferences_count} 条偏好记录到数据库。")
 